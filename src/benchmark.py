@@ -0,0 +1,300 @@
+import hashlib
+import math
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from models.wallet import Wallet
+from models.transaction import Transaction
+from models.blockchain import Blockchain
+from utility.hash_util import hash_block
+from utility.verification import Verification
+from utility.difficulty import target
+
+"""
+load generator and benchmark for the node
+starts --nodes node.py processes on ports --base-port, --base-port + 1 ..., connects them to each other,
+sends --transactions signed transactions at --rate per second, mines --blocks blocks and prints:
+accepted transactions per second, hashrate, block broadcast latency, memory per chain length
+and micro timings of get_balance, hash_block and verify_chain
+
+    python benchmark.py --nodes 3 --transactions 2000 --batch 100 --blocks 10
+"""
+
+NODE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node.py')
+AMOUNT = 0.01  # sent by every generated transaction
+STARTUP_TIMEOUT = 30  # seconds a node may take until it answers
+PROPAGATION_TIMEOUT = 30  # seconds a block may take to reach every node
+POLL_INTERVAL = 0.005
+
+
+def percentile(values, p):
+    """ p-th percentile (0 - 100) of a list of numbers, nearest rank """
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(math.ceil(p / 100 * len(ordered))) - 1))]
+
+
+def timed(func, repeat):
+    """ average seconds per call of func """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def memory_kb(pid):
+    """ resident memory of a node (the process and everything it started), None where /proc is missing """
+    total = 0
+    try:
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/{}/stat'.format(entry)) as f:
+                    # the name may contain spaces, the fields after it do not
+                    session = int(f.read().rsplit(')', 1)[1].split()[3])
+                if session != pid:
+                    continue
+                with open('/proc/{}/status'.format(entry)) as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            total += int(line.split()[1])
+            except (IOError, IndexError, ValueError):
+                continue
+    except IOError:
+        return None
+    return total
+
+
+class LocalNetwork:
+    """ node.py processes on consecutive ports, every one in its own folder and process group """
+    def __init__(self, count, base_port, workdir, server):
+        self.ports = [base_port + i for i in range(count)]
+        self.workdir = workdir
+        self.processes = []
+        self.logs = []
+        for port in self.ports:
+            folder = os.path.join(workdir, 'node-{}'.format(port))
+            os.makedirs(folder, exist_ok=True)
+            log = open(os.path.join(folder, 'node.log'), 'w')
+            self.logs.append(log)
+            self.processes.append(subprocess.Popen([sys.executable, NODE_SCRIPT, '-p', str(port), '--server', server],
+                                                   cwd=folder, stdout=log, stderr=subprocess.STDOUT,
+                                                   start_new_session=True))
+        self.session = requests.Session()
+
+    def url(self, port, path):
+        return 'http://localhost:{}/{}'.format(port, path)
+
+    def wait_until_ready(self):
+        deadline = time.time() + STARTUP_TIMEOUT
+        for port in self.ports:
+            while True:
+                try:
+                    self.session.get(self.url(port, 'chain/tip'), timeout=1)
+                    break
+                except requests.exceptions.RequestException:
+                    if time.time() > deadline:
+                        raise RuntimeError('node {} did not start, see its node.log'.format(port))
+                    time.sleep(0.2)
+
+    def connect(self):
+        """ a wallet for every node and every node a peer of every other one, returns the wallet keys of the nodes """
+        keys = [self.session.post(self.url(port, 'wallet')).json() for port in self.ports]
+        for port in self.ports:
+            for peer in self.ports:
+                if peer != port:
+                    self.session.post(self.url(port, 'node'), json={'node': 'localhost:{}'.format(peer)})
+        return keys
+
+    def height(self, port):
+        return self.session.get(self.url(port, 'chain/tip')).json()['height']
+
+    def mine(self, port):
+        """ mine on one node, returns (seconds to mine, seconds until every other node has the block, difficulty) """
+        start = time.perf_counter()
+        response = self.session.post(self.url(port, 'mine'))
+        mined = time.perf_counter()
+        if response.status_code != 201:
+            raise RuntimeError('mining on {} failed: {}'.format(port, response.text))
+        height = response.json()['block']['index'] + 1
+        deadline = time.time() + PROPAGATION_TIMEOUT
+        for peer in self.ports:
+            while peer != port and self.height(peer) < height:
+                if time.time() > deadline:
+                    raise RuntimeError('block did not reach {}'.format(peer))
+                time.sleep(POLL_INTERVAL)
+        return mined - start, time.perf_counter() - mined, response.json()['block']['difficulty']
+
+    def memory(self):
+        return [memory_kb(process.pid) for process in self.processes]
+
+    def stop(self):
+        for process in self.processes:
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.wait()
+        for log in self.logs:
+            log.close()
+
+
+def generate_transactions(sender_keys, count):
+    """ signed transactions (dicts) from one wallet to count different recipients """
+    wallet = Wallet(None)
+    wallet.public_key = sender_keys['public_key']
+    wallet.private_key = sender_keys['private_key']
+    recipients = ['benchmark-recipient-{}'.format(i) for i in range(count)]
+    # signed all at once, on every core for large counts
+    payments = [(recipient, AMOUNT, Transaction.new_nonce()) for recipient in recipients]
+    signatures = wallet.sign_transactions(payments)
+    return [{
+        'sender': wallet.public_key,
+        'recipient': recipient,
+        'amount': AMOUNT,
+        'signature': signature,
+        'nonce': nonce
+    } for (recipient, _, nonce), signature in zip(payments, signatures)]
+
+
+def submit_transactions(network, transactions, rate, batch):
+    """
+    send the transactions to the nodes in turn, at most rate per second (0: as fast as possible)
+    returns (accepted, seconds)
+    """
+    accepted = 0
+    start = time.perf_counter()
+    for number, first in enumerate(range(0, len(transactions), batch)):
+        chunk = transactions[first:first + batch]
+        port = network.ports[number % len(network.ports)]
+        if batch == 1:
+            response = network.session.post(network.url(port, 'broadcast-transaction'), json=chunk[0])
+            accepted += response.status_code == 201
+        else:
+            response = network.session.post(network.url(port, 'broadcast-transactions'), json={'transactions': chunk})
+            accepted += sum(response.json().get('results', []))
+        if rate > 0:
+            # wait until this many transactions are due
+            delay = start + (first + len(chunk)) / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    return accepted, time.perf_counter() - start
+
+
+def hashrate(seconds=2.0):
+    """ proof of work guesses per second of one core, the same loop ProofOfWorkMiner runs """
+    midstate = hashlib.sha256(b'0:' + b'0' * 64 + b':' + b'0' * 64 + b':0:8:')
+    proof_target = target(255)  # never met, every guess is tried
+    proof = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(10000):
+            guess_hash = midstate.copy()
+            guess_hash.update(str(proof).encode())
+            if int.from_bytes(guess_hash.digest(), 'big') < proof_target:
+                break
+            proof += 1
+    return proof / (time.perf_counter() - start)
+
+
+def micro_timings(folder, port, public_key, repeat):
+    """ get_balance, hash_block and verify_chain on a copy of a node's store, run in this process """
+    copy = os.path.join(folder, 'copy')
+    shutil.copytree(os.path.join(folder, 'blockchain-{}'.format(port)), os.path.join(copy, 'blockchain-{}'.format(port)))
+    cwd = os.getcwd()
+    os.chdir(copy)
+    try:
+        blockchain = Blockchain(public_key, port)
+        chain = blockchain.chain
+        last_block = chain[-1]
+
+        def hash_fresh():
+            last_block.proof = last_block.proof  # any change drops the remembered hash
+            hash_block(last_block)
+        return {
+            'get_balance': timed(lambda: blockchain.get_balance(public_key), repeat),
+            'hash_block': timed(hash_fresh, repeat),
+            'verify_chain': timed(lambda: Verification.verify_chain(chain), 1),
+            'chain_length': len(chain)
+        }
+    finally:
+        os.chdir(cwd)
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=5200)
+    parser.add_argument('--transactions', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=0, help='transactions per second, 0 for as fast as possible')
+    parser.add_argument('--batch', type=int, default=100, help='transactions per request, 1 uses /broadcast-transaction')
+    parser.add_argument('--blocks', type=int, default=10, help='blocks mined after the transactions are sent')
+    parser.add_argument('--server', choices=['dev', 'waitress'], default='dev')
+    parser.add_argument('--workdir', help='folder for the node data, a temporary one by default')
+    parser.add_argument('--keep', action='store_true', help='do not delete the node data afterwards')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='blockchain-benchmark-')
+    network = LocalNetwork(args.nodes, args.base_port, workdir, args.server)
+    memory = []  # (chain length, [kB per node])
+    try:
+        network.wait_until_ready()
+        keys = network.connect()
+        first_port = network.ports[0]
+
+        # the first node mines until it can pay every transaction
+        funding_blocks = int(math.ceil(args.transactions * AMOUNT / 10)) + 1
+        print('Mining {} blocks to fund the transactions...'.format(funding_blocks))
+        for _ in range(funding_blocks):
+            network.mine(first_port)
+        memory.append((network.height(first_port), network.memory()))
+
+        print('Signing {} transactions...'.format(args.transactions))
+        transactions = generate_transactions(keys[0], args.transactions)
+        accepted, seconds = submit_transactions(network, transactions, args.rate, max(1, args.batch))
+
+        mining_times, latencies, difficulty = [], [], None
+        for number in range(args.blocks):
+            mining_time, latency, difficulty = network.mine(network.ports[number % len(network.ports)])
+            mining_times.append(mining_time)
+            latencies.append(latency)
+            memory.append((network.height(first_port), network.memory()))
+        network.stop()
+
+        print()
+        print('transactions accepted   {} of {} in {:.2f}s, {:.1f}/s'.format(accepted, len(transactions), seconds,
+                                                                            accepted / seconds if seconds else 0))
+        if mining_times:
+            print('block time              avg {:.3f}s at difficulty {}'.format(sum(mining_times) / len(mining_times),
+                                                                              difficulty))
+            print('block broadcast latency p50 {:.1f}ms  p90 {:.1f}ms  p99 {:.1f}ms  max {:.1f}ms'.format(
+                *(percentile(latencies, p) * 1000 for p in (50, 90, 99, 100))))
+        print('hashrate (one core)     {:.0f} hashes/s, {} cores'.format(hashrate(), os.cpu_count()))
+        timings = micro_timings(os.path.join(workdir, 'node-{}'.format(first_port)), first_port,
+                                keys[0]['public_key'], 1000)
+        print('get_balance             {:.2f}us'.format(timings['get_balance'] * 1e6))
+        print('hash_block              {:.2f}us'.format(timings['hash_block'] * 1e6))
+        print('verify_chain            {:.2f}ms for {} blocks'.format(timings['verify_chain'] * 1000,
+                                                                     timings['chain_length']))
+        print('memory (kB per node)')
+        for height, sizes in memory:
+            print('  {:>6} blocks  {}'.format(height, '  '.join('n/a' if size is None else str(size) for size in sizes)))
+    finally:
+        network.stop()
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
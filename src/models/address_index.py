@@ -0,0 +1,47 @@
+from array import array
+
+
+class AddressIndex:
+    """
+    transaction history of every address (sender or recipient), as (block index, position in block) pairs
+    kept in sync with the chain block by block like the Ledger, so the history of an address is
+    looked up without scanning the chain
+    """
+    def __init__(self):
+        # {address: array of block index, position, block index, position ...}, oldest first
+        # an array of ints is much smaller than a list of tuples
+        self.__history = {}
+
+    def apply_block(self, block):
+        """ add the transactions of a newly appended block """
+        for position, tx in enumerate(block.transactions):
+            self.__add(tx.sender, block.index, position)
+            if tx.recipient != tx.sender:
+                self.__add(tx.recipient, block.index, position)
+
+    def __add(self, address, block_index, position):
+        entries = self.__history.get(address)
+        if entries is None:
+            entries = self.__history[address] = array('q')
+        entries.append(block_index)
+        entries.append(position)
+
+    def revert_block(self, block):
+        """ undo apply_block, blocks are dropped from the end, so their entries are the last ones of every address """
+        for tx in block.transactions:
+            for address in (tx.sender, tx.recipient):
+                entries = self.__history.get(address)
+                while entries and entries[-2] == block.index:
+                    del entries[-2:]
+                if entries is not None and not entries:
+                    del self.__history[address]
+
+    def count(self, address):
+        """ number of transactions address is part of """
+        return len(self.__history.get(address, ())) // 2
+
+    def history(self, address, start=0, limit=None):
+        """ list of (block index, position), oldest first, from the start-th transaction of address on """
+        entries = self.__history.get(address, ())
+        end = len(entries) if limit is None else min(len(entries), 2 * (start + limit))
+        return [(entries[i], entries[i + 1]) for i in range(2 * max(start, 0), end, 2)]
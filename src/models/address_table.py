@@ -0,0 +1,39 @@
+import threading
+from collections import OrderedDict
+
+
+ADDRESS_TABLE_SIZE = 10000  # addresses kept, about 3 MB of rsa public keys, the least recently used one is dropped
+
+
+class AddressTable:
+    """
+    every address (hex public key, or 'MINING') of a verified transaction is stored once,
+    the transactions share that one string instead of keeping a copy each (see Transaction.intern)
+    a public key is about 324 characters, so this saves a lot when the same wallets appear again and again
+    only verified transactions are interned, junk from a client or peer does not stay in memory
+    the table is bounded, scanning the whole chain does not keep every address of it in memory:
+    a dropped address stays with the transactions which share it, only new ones get their own copy again
+    """
+    def __init__(self, max_size=ADDRESS_TABLE_SIZE):
+        self.max_size = max_size
+        self.__addresses = OrderedDict()  # {address: the instance the interned transactions share}, most recent last
+        # request threads and the writer intern at the same time
+        self.__lock = threading.Lock()
+
+    def intern(self, address):
+        with self.__lock:
+            shared = self.__addresses.get(address)
+            if shared is not None:
+                self.__addresses.move_to_end(address)
+                return shared
+            self.__addresses[address] = address
+            if len(self.__addresses) > self.max_size:
+                self.__addresses.popitem(last=False)
+            return address
+
+    def __len__(self):
+        return len(self.__addresses)
+
+
+# one table for the whole process
+addresses = AddressTable()
@@ -1,13 +1,76 @@
 from time import time
 from utility.printable import Printable
+from utility.hash_util import header_prefix, hash_string_256
+from utility.merkle import merkle_root
+from models.transaction import Transaction
+from utility.difficulty import INITIAL_DIFFICULTY
 
 
 class Block(Printable):
-    def __init__(self, index, previous_hash, transactions, proof, timestamp=None):
+    # no __dict__ per block, the chain can hold many of them
+    __slots__ = ('index', 'previous_hash', 'timestamp', 'transactions', 'proof', 'difficulty', 'merkle_root', '__hash')
+
+    def __init__(self, index, previous_hash, transactions, proof, timestamp=None, difficulty=INITIAL_DIFFICULTY,
+                 merkle_root=None):
         self.index = index
         self.previous_hash = previous_hash
         self.timestamp = time() if timestamp is None else timestamp
-        self.transactions = transactions
+        # a tuple, so the transactions of a block can not change behind its merkle root
+        self.transactions = tuple(transactions)
         self.proof = proof
+        self.difficulty = difficulty  # leading zero bits the proof of work of this block has
+        # commits the header to the transactions, a block received from a peer brings its own (checked by Verification)
+        self.merkle_root = self.compute_merkle_root() if merkle_root is None else merkle_root
+
+    def __setattr__(self, name, value):
+        # a changed field makes the remembered hash stale
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_Block__hash', None)
+
+    def compute_merkle_root(self):
+        return merkle_root([tx.id() for tx in self.transactions])
+
+    def header_prefix(self):
+        """ header without the proof, see hash_util.header_prefix """
+        return header_prefix(self)
+
+    def hash(self):
+        """ sha256 of the header (proof included), computed once """
+        if self.__hash is None:
+            object.__setattr__(self, '_Block__hash', hash_string_256(self.header_prefix() + str(self.proof).encode()))
+        return self.__hash
+
+    def header(self):
+        """ the fields the block hash is computed from, without transactions """
+        return {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'merkle_root': self.merkle_root,
+            'timestamp': self.timestamp,
+            'difficulty': self.difficulty,
+            'proof': self.proof
+        }
+
+    def to_dict(self):
+        """ json serializable form, transactions are converted to dict as well """
+        return {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'timestamp': self.timestamp,
+            'transactions': [tx.to_dict() for tx in self.transactions],
+            'proof': self.proof,
+            'difficulty': self.difficulty,
+            'merkle_root': self.merkle_root
+        }
 
+    @classmethod
+    def from_header(cls, header):
+        """ block without its transactions, as a light node keeps it, the merkle root still commits to them """
+        return cls(header['index'], header['previous_hash'], [], header['proof'], header['timestamp'],
+                   header['difficulty'], header['merkle_root'])
 
+    @classmethod
+    def from_dict(cls, block):
+        transactions = [Transaction.from_dict(tx) for tx in block['transactions']]
+        return cls(block['index'], block['previous_hash'], transactions, block['proof'], block['timestamp'],
+                   block.get('difficulty', INITIAL_DIFFICULTY), block.get('merkle_root'))
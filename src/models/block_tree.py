@@ -0,0 +1,75 @@
+from collections import OrderedDict
+
+
+SIDE_BLOCKS_MAX = 1000  # blocks kept on side branches, the oldest one is dropped when a new one does not fit
+ORPHANS_MAX = 100  # blocks kept while their parent is unknown
+
+
+class BlockTree:
+    """
+    the blocks a node knows besides its chain, keyed by block hash
+    side blocks: their parent is on the chain or another side block, together with the chain they form a tree,
+                 a branch with more work than the chain is switched to (see Blockchain.add_block)
+    orphans: their parent is unknown, they are kept until it arrives
+    the chain itself stays in the block store, only these few blocks are held in memory
+    """
+    def __init__(self, side_blocks_max=SIDE_BLOCKS_MAX, orphans_max=ORPHANS_MAX):
+        self.side_blocks_max = side_blocks_max
+        self.orphans_max = orphans_max
+        self.__side = OrderedDict()  # {block hash: block}, oldest first
+        self.__orphans = OrderedDict()  # {block hash: block}, oldest first
+        self.__children = {}  # {parent hash: set of orphan hashes}
+
+    def __contains__(self, block_hash):
+        return block_hash in self.__side or block_hash in self.__orphans
+
+    def add_side(self, block_hash, block):
+        self.__side[block_hash] = block
+        if len(self.__side) > self.side_blocks_max:
+            self.__side.popitem(last=False)
+
+    def remove_side(self, block_hash):
+        self.__side.pop(block_hash, None)
+
+    def branch(self, block_hash, on_chain):
+        """
+        the side blocks from the chain up to block_hash (included), oldest first
+        on_chain(block hash) tells whether a block is on the chain, None if the branch does not reach it
+        """
+        blocks = []
+        while block_hash in self.__side:
+            block = self.__side[block_hash]
+            blocks.append(block)
+            block_hash = block.previous_hash
+        if not on_chain(block_hash):
+            return None
+        blocks.reverse()
+        return blocks
+
+    def add_orphan(self, block_hash, block):
+        if block_hash in self.__orphans:
+            return
+        self.__orphans[block_hash] = block
+        self.__children.setdefault(block.previous_hash, set()).add(block_hash)
+        if len(self.__orphans) > self.orphans_max:
+            self.__remove_orphan(next(iter(self.__orphans)))
+
+    def __remove_orphan(self, block_hash):
+        block = self.__orphans.pop(block_hash)
+        children = self.__children[block.previous_hash]
+        children.discard(block_hash)
+        if not children:
+            del self.__children[block.previous_hash]
+        return block
+
+    def take_orphans(self, parent_hash):
+        """ remove and return the orphans whose parent is parent_hash, as (block hash, block) """
+        return [(block_hash, self.__remove_orphan(block_hash)) for block_hash in list(self.__children.get(parent_hash, ()))]
+
+    def orphan_count(self):
+        """ number of orphans kept, a gauge of /metrics """
+        return len(self.__orphans)
+
+    def side_count(self):
+        """ number of side blocks kept, a gauge of /metrics """
+        return len(self.__side)
@@ -1,147 +1,282 @@
-import functools
 import json
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from time import time
 
-from utility.hash_util import hash_block
+from utility.hash_util import canonical_snapshot, hash_block
+from utility.merkle import merkle_path
 from models.block import Block
 from models.transaction import Transaction
 from utility.verification import Verification
-from models.wallet import Wallet
+from models.ledger import Ledger
+from models.address_index import AddressIndex
+from models.mempool import Mempool
+from models.lazy_chain import ChainChanged, ForkView, LazyChain
+from models.block_tree import BlockTree
+from models.peer_manager import CONNECT_TIMEOUT, PeerManager
+from utility.block_store import BlockStore
+from utility.miner import ProofOfWorkMiner
+from utility.broadcaster import Broadcaster
+from utility.seen_set import SeenSet
+from utility.difficulty import chain_work, next_difficulty
+from utility.metrics import metrics
+from utility.codec import ACCEPT, MIMETYPE, block_payload, decode_block_list
 
 
 MINING_REWARD = 10
+LEDGER_CHECKPOINT_INTERVAL = 100  # the balance index is saved every 100 blocks
+MAX_CLOCK_DRIFT = 2 * 60 * 60  # seconds a block timestamp may be ahead of our clock
+RESOLVE_WORKERS = 8  # peers asked at the same time when resolving conflicts
+RESOLVE_TIMEOUT = (CONNECT_TIMEOUT, 5)  # seconds to connect, seconds to wait for an answer
+HEADERS_PER_REQUEST = 2000  # headers asked from a peer at a time while syncing
+BODIES_PER_REQUEST = 100  # blocks asked from a peer at a time, different chunks go to different peers
+SNAPSHOT_INTERVAL = 1000  # a signed snapshot of the balances is made every 1000 blocks
+PRUNE_DEPTH = 100  # with pruning, the last 100 blocks below a snapshot keep their transactions for short forks
+SEEN_SET_SIZE = 100000  # transaction ids and block hashes remembered, see SeenSet
+MEMPOOL_LOG_COMPACT = 2  # mempool.log is rewritten once it holds twice as many records as transactions are open
+INDEX_BUILD_ATTEMPTS = 3  # scans without the lock before an index is built with it held, see build_index
+REQUEST_TTL = 10  # seconds an item we requested is not requested again from another peer
+
+# what add_block did with a block
+BLOCK_ADDED = 'added'  # it is on our chain now, at the end or after switching to its branch
+BLOCK_SIDE = 'side'  # kept on a branch with less work than our chain
+BLOCK_ORPHAN = 'orphan'  # its parent is unknown, kept until it arrives
+BLOCK_KNOWN = 'known'  # we have it already
+BLOCK_INVALID = 'invalid'
 
 
 class Blockchain:
-    def __init__(self, public_key, node_id):  # hosting_node is public_key
-        genesis_block = Block(0, '', [], 100, 0)
-        # __open_transactions should only be accessed within this class
-        self.chain = [genesis_block]  # initialize blockchain list
-        self.__open_transactions = []  # open_transactions is list of transaction, not including reward
+    def __init__(self, public_key, node_id, light=False, signer=None, trusted_keys=(), bootstrap_node=None,
+                 prune=False):  # hosting_node is public_key
+        # balance index, kept in sync with __chain
+        self.__ledger = Ledger()
+        # __mempool should only be accessed within this class
+        self.__mempool = Mempool()  # open transactions, not including reward
         self.public_key = public_key
-        self.__peer_nodes = set()
         self.node_id = node_id
         self.resolve_conflicts = False
+        # a light node only keeps block headers, it can follow the chain but not check balances or mine
+        self.light = light
+        # signs our snapshots (Wallet.sign_message), snapshots of other nodes are only loaded if a trusted key signed them
+        self.__signer = signer
+        self.trusted_keys = set(trusted_keys)
+        # a fresh node starts from the snapshot of this peer instead of the genesis block, see bootstrap
+        self.bootstrap_node = bootstrap_node
+        # drop the transactions of old blocks once a snapshot covers them
+        self.prune = prune
+        # append-only storage, every write below is O(1) instead of rewriting the whole chain
+        self.__store = BlockStore(node_id)
+        # peer nodes with their round trip time, failures and height, saved to peers.json of the store
+        self.__peers = PeerManager(save=self.__store.save_peers)
+        # blocks are read from the store when they are needed, not at startup
+        self.__chain = LazyChain(self.__store)
+        # {transaction id: (block index, position in block)}, built on the first proof request
+        self.__transaction_index = None
+        # history of every address (AddressIndex), built on the first history request
+        self.__address_index = None
+        # one index is built at a time, a second request waits for it instead of scanning as well
+        self.__index_build_lock = threading.Lock()
+        # counts prunes, an index scanned across one of them is thrown away (a reorganization shows in the view)
+        self.__index_resets = 0
+        # single writer: chain, ledger and mempool are only changed with this lock held (peers have their own),
+        # readers (/chain, /balance, /transactions, /nodes) do not take it, see get_open_transactions
+        self.__lock = threading.RLock()
+        self.__open_transactions = (-1, ())  # (mempool version, tuple of open transactions)
+        # proof of work runs on every core, a competing block can cancel it
+        self.__miner = ProofOfWorkMiner()
+        # peers are informed in the background, see Broadcaster
+        self.__broadcaster = Broadcaster(self.__peers)
+        # a peer removed after too many failures keeps no connections open
+        self.__peers.on_evict = self.__broadcaster.forget
+        # items we have or just requested, an announced item is only requested if it is not in here, see wanted
+        self.__seen = SeenSet(SEEN_SET_SIZE)
+        # blocks of other branches and orphans, our chain is in the block store
+        self.__tree = BlockTree()
+        # resolve runs on its own thread when it is needed, see request_resolve
+        self.__resolver = ThreadPoolExecutor(max_workers=1)
+        self.__resolve_waiting = threading.Lock()
         self.load_data()
 
     """
     if you want to control access for both reading and writing, you can use @property
     python create private property, and gives us getter and setter
-    Notice: __chain is created automatically by this
     """
     # this is getter
     # when I try to get value for chain, this code is executed
+    # a read-only view instead of a copy, so nobody can change __chain from outside
     @property
     def chain(self):
-        return self.__chain[:]
+        return self.__chain.snapshot()
 
-    # this is setter
-    # when I try to set something to chain, this code is executed
-    # therefore, we can load data and overwrite entire chain
-    @chain.setter
-    def chain(self, val):
-        self.__chain = val
+    def get_mempool_size(self):
+        return len(self.__mempool)
+
+    def get_orphan_count(self):
+        """ blocks waiting for their parent """
+        return self.__tree.orphan_count()
+
+    def get_side_block_count(self):
+        """ blocks kept on side branches """
+        return self.__tree.side_count()
 
     def get_open_transactions(self):
-        return self.__open_transactions[:]
+        """ copy of the open transactions, only rebuilt (with the lock) after the mempool changed """
+        version, transactions = self.__open_transactions
+        if version != self.__mempool.version:
+            with self.__lock:
+                version = self.__mempool.version
+                transactions = tuple(self.__mempool.transactions())
+                self.__open_transactions = (version, transactions)
+        return list(transactions)
 
     def load_data(self):
+        """
+        only the block index is read here, blocks are loaded from disk when they are accessed
+        the balance index starts from its last checkpoint, so startup does not depend on chain length
+        """
+        start = time()
         try:
-            # mode should be 'rb' if using pickle, and txt should be p
-            with open('blockchain-{}.txt'.format(self.node_id), mode='r') as f:
-                # file_content = pickle.loads(f.read())
-                # blockchain = file_content['chain']
-                # open_transactions = file_content['ot']
-                file_content = f.readlines()
-                # from string to python object
-                blockchain = json.loads(file_content[0][:-1])  # without '\n'
-                # at this time, blockchain is a list of dict  # [{..}, {..}...]
-                updated_blockchain = []
-                for block in blockchain:
-                    converted_tx = [Transaction(tx['sender'], tx['recipient'], tx['signature'], tx['amount']) for tx in block['transactions']]  # a list of transaction object
-                    # block = {...} for now
-                    updated_block = Block(block['index'], block['previous_hash'], converted_tx, block['proof'], block['timestamp'])
-                    updated_blockchain.append(updated_block)
-                self.chain = updated_blockchain  # a list of block object will be loaded by setter
-
-                open_transactions = json.loads(file_content[1][:-1])
-                updated_transactions = []
-                for tx in open_transactions:
-                    updated_transaction = Transaction(tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
-                    updated_transactions.append(updated_transaction)
-                self.__open_transactions = updated_transactions
-
-                peer_nodes = json.loads(file_content[2])
-                self.__peer_nodes = set(peer_nodes)
+            # a node which still has the old single file is migrated into the block store once
+            if self.__store.height == 0:
+                self.import_legacy_data()
+            if self.__store.height == 0 and self.bootstrap_node is not None:
+                self.bootstrap(self.bootstrap_node)
+            # fresh node, the genesis block is the first record on disk
+            if self.__store.height == 0:
+                genesis_block = Block(0, '', [], 100, 0)
+                self.__chain.append(genesis_block, hash_block(genesis_block))
+            self.load_ledger()
+
+            self.__mempool.reset(self.__store.load_transactions())
+            self.__peers.restore(self.__store.load_peers())
 
         # IOError is file not found error
         except (IOError, IndexError):
-           pass
+            pass
         finally:
+            metrics.set('load_data_seconds', time() - start)
             print('Cleanup!')
 
-    def save_data(self):
+    def load_ledger(self):
+        """ restore the balance index from its last checkpoint (or snapshot) and replay the blocks after it """
+        checkpoint = self.__store.load_ledger() or self.__store.load_snapshot()
+        if checkpoint is None:
+            height = 0
+            self.__ledger.restore({})
+        else:
+            height = checkpoint['height']
+            self.__ledger.restore(checkpoint['balances'])
+        for index in range(height, len(self.__chain)):
+            self.__ledger.apply_block(self.__chain[index])
+
+    def save_ledger(self):
+        self.__store.save_ledger(len(self.__chain), self.__chain.block_hash(-1), self.__ledger.balances())
+
+    def save_snapshot(self):
+        """ signed balances at the current last block, other nodes can start from it (see bootstrap) """
+        snapshot = {
+            'height': len(self.__chain),
+            'hash': self.__chain.block_hash(-1),
+            'balances': self.__ledger.balances(),
+            'signer': self.public_key
+        }
+        snapshot['signature'] = self.__signer(canonical_snapshot(snapshot))
+        self.__store.save_snapshot(snapshot)
+        if self.prune:
+            self.__store.prune(snapshot['height'] - PRUNE_DEPTH)
+            self.__chain.clear_cache()
+            # both would point to transactions which are gone now
+            self.__transaction_index = None
+            self.__address_index = None
+            self.__index_resets += 1
+
+    def get_snapshot(self):
+        """ the last snapshot (dict), None if there is none """
+        return self.__store.load_snapshot()
+
+    def bootstrap(self, node):
+        """
+        start from the last snapshot of a peer instead of verifying every block from the genesis block on
+        the snapshot has to be signed by one of trusted_keys, the headers below it only have to link up to its hash
+        with prune, the blocks below it are not downloaded, only their headers
+        """
+        try:
+            snapshot = requests.get('http://{}/snapshot'.format(node), timeout=RESOLVE_TIMEOUT).json()
+            if not Verification.verify_snapshot(snapshot, self.trusted_keys):
+                print('Snapshot of {} is not signed by a trusted key'.format(node))
+                return False
+            headers = self.fetch_headers(node, 0, snapshot['height'])
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+            return False
+        if len(headers) != snapshot['height'] or not Verification.verify_links(headers, snapshot['hash']):
+            return False
+        blocks = headers if self.prune else self.fetch_bodies(headers, [node])
+        if blocks is None:
+            return False
+        for block in blocks:
+            self.__chain.append(block, hash_block(block))
+        self.__store.save_ledger(snapshot['height'], snapshot['hash'], snapshot['balances'])
+        self.__store.save_snapshot(snapshot)
+        if self.prune:
+            self.__store.prune(snapshot['height'])
+            self.__chain.clear_cache()
+        return True
+
+    def import_legacy_data(self):
+        """ copy blockchain-<node_id>.txt (chain, open transactions, peers on three lines) into the block store """
         try:
-            # mode should be 'rb' if using pickle, and txt should be p
-            with open('blockchain-{}.txt'.format(self.node_id), mode='w') as f:
-                # chain_with_dict_tx is a list of block object, which consist dict transaction
-                # [tx.__dict__ for tx in block_el.transactions]
-                chain_with_dict_tx = [Block(block_el.index, block_el.previous_hash, [tx.__dict__ for tx in block_el.transactions], block_el.proof, block_el.timestamp) for block_el in self.__chain]
-
-                saveable_chain = [block.__dict__ for block in chain_with_dict_tx]
-                # save as json data
-                f.write(json.dumps(saveable_chain))  # from list to string
-                f.write('\n')
-                saveable_tx = [tx.__dict__ for tx in self.__open_transactions]
-                f.write(json.dumps(saveable_tx))  # from list ot string
-                f.write('\n')
-                f.write(json.dumps(list(self.__peer_nodes)))
-                """
-                save as binary data
-                save_data = {
-                    'chain': blockchain,
-                    'ot': open_transactions
-                }
-                f.write(pickle.dumps(save_data))
-                """
-        except IOError:
-            print('Saving failed!')
-
-    def proof_of_work(self):
-        """
-        Generate a proof of work for the open transactions,
-        the hash of the previous block and a random number (which is guessed until it fits).
-        """
-        last_block = self.__chain[-1]
-        last_hash = hash_block(last_block)
-        proof = 0
-        # Try different PoW numbers and return the first valid one
-        while not Verification.valid_proof(self.__open_transactions, last_hash, proof):
-            proof += 1
+            with open('blockchain-{}.txt'.format(self.node_id), mode='r') as f:
+                file_content = f.readlines()
+                # from string to python object
+                blockchain = json.loads(file_content[0][:-1])  # without '\n'
+                open_transactions = json.loads(file_content[1][:-1])
+                peer_nodes = json.loads(file_content[2])
+        except (IOError, IndexError, ValueError):
+            return
+        for block in blockchain:
+            converted_block = Block.from_dict(block)
+            self.__store.append_block(converted_block, hash_block(converted_block))
+        self.__store.save_transactions([Transaction.from_dict(tx) for tx in open_transactions])
+        self.__store.save_peers(peer_nodes)
+
+    def proof_of_work(self, block):
+        """
+        Generate a proof of work for the header of block (previous hash, merkle root of its transactions ...)
+        and a random number (which is guessed until it fits).
+        Returns None if mining was cancelled by cancel_mining.
+        """
+        # Try different PoW numbers on all cores and return the first valid one
+        start = time()
+        proof = self.__miner.mine(block.header_prefix(), block.difficulty)
+        seconds = time() - start
+        if proof is None:
+            metrics.inc('pow_cancelled_total')
+            return None
+        # the nonces are tried in order (interleaved between the workers), so about proof + 1 guesses were made
+        metrics.inc('pow_blocks_total')
+        metrics.inc('pow_attempts_total', proof + 1)
+        metrics.observe('pow_seconds', seconds)
+        if seconds > 0:
+            metrics.set('pow_hashrate', (proof + 1) / seconds)
         return proof
 
+    def cancel_mining(self):
+        """ stop a running proof of work, the block it was for can no longer be added """
+        self.__miner.cancel()
+
     def get_balance(self, sender=None):
+        # a light node has no transactions to count
+        if self.light:
+            return None
         if sender is None:
             if self.public_key is None:
                 return None
             participant = self.public_key
         else:
             participant = sender
-        # self.__chain   =   [block object, ...]
-        # block.transactions  =  [transactions object, ...]
-        # amount in blockchain
-        tx_sender = [[tx.amount for tx in block.transactions if tx.sender == participant] for block in self.__chain]
-        # amount in open transaction
-        open_tx_sender = [tx.amount for tx in self.__open_transactions if tx.sender == participant]
-        tx_sender.append(open_tx_sender)  # a list, consist all send transaction(blockchain and open transaction)
-        # print(tx_sender)  # [[], [], [], [], [12.0, 2.0], [9.4], [3.0, 2.1, 1.2], []]
-        amount_sent = functools.reduce(lambda tx_sum, tx_amt: tx_sum + sum(tx_amt) if len(tx_amt) > 0 else tx_sum + 0, tx_sender, 0)
-
-        tx_recipient = [[tx.amount for tx in block.transactions if tx.recipient == participant] for block in self.__chain]
-        amount_received = functools.reduce(lambda tx_sum, tx_amt: tx_sum + sum(tx_amt) if len(tx_amt) > 0 else tx_sum + 0, tx_recipient, 0)
-
-        # return total balance
-        return amount_received - amount_sent
+        # confirmed balance from the index minus what participant sent in open transactions
+        return self.__ledger.balance(participant) - self.__mempool.pending_sent(participant)
 
     def get_last_blockchain_value(self):
         """ Returns the last value of the current blockchain. """
@@ -149,7 +284,7 @@ class Blockchain:
             return None
         return self.__chain[-1]
 
-    def add_transaction(self, recipient, sender, signature, amount=1.0, is_receiving=False):
+    def add_transaction(self, recipient, sender, signature, amount=1.0, nonce=None):
         """
         can not use this becasue dict is not ordered object
         transaction = {
@@ -160,26 +295,68 @@ class Blockchain:
         """
         # if self.public_key == None:
         #     return False
-        transaction = Transaction(sender, recipient, signature, amount)
-        if Verification.verify_transaction(transaction, self.get_balance):
-            self.__open_transactions.append(transaction)
-            self.save_data()
-
-            # only broadcast to peer node if we are on the node where we originally create that transaction
-            if not is_receiving:
-                # broadcast transaction to each peer node
-                for node in self.__peer_nodes:
-                    url = 'http://{}/broadcast-transaction'.format(node)
-                    try:
-                        response = requests.post(url, json={'sender': sender, 'recipient': recipient,
-                                                 'amount': amount, 'signature': signature})
-                        if response.status_code == 400 or response.status_code == 500:
-                            print('Broadcast transaction declined, needs resolving')
-                            return False
-                    except requests.exceptions.ConnectionError:  # the server of node is not running
-                        continue  # this node does not running, others may do, so continue
-            return True
-        return False
+        return self.add_transactions([{'sender': sender, 'recipient': recipient,
+                                       'signature': signature, 'amount': amount, 'nonce': nonce}])[0]
+
+    def add_transactions(self, transactions):
+        """
+        add a batch of transactions (dicts with sender, recipient, signature and amount)
+        signatures are verified together, every sender's balance is looked up once,
+        the accepted ones are written to disk at once and announced to the peers as one inventory message,
+        no matter whether they were created here or came from a peer (that is how they travel further)
+        returns True/False for every transaction, in the same order, True only for the ones which were stored
+        (False for one which is already open or repeats an earlier one of the batch, new payments get their own nonce,
+        see Transaction.new_nonce, so only a copy of the same transaction is refused)
+        """
+        # without balances a light node can not verify the transaction
+        if self.light:
+            return [False] * len(transactions)
+        converted = [Transaction(tx['sender'], tx['recipient'], tx['signature'], tx['amount'], tx.get('nonce'))
+                     for tx in transactions]
+        results = [False] * len(converted)
+        # a transaction we already have (e.g. broadcast to us again) is neither verified nor broadcast again
+        new_positions = []
+        seen = set()
+        for position, tx in enumerate(converted):
+            nonce = tx.nonce  # a number, see Transaction.new_nonce
+            if tx.id() not in seen and tx.id() not in self.__mempool and \
+                    (nonce is None or type(nonce) is int and nonce >= 0):
+                new_positions.append(position)
+            seen.add(tx.id())
+        # the signatures are checked before taking the lock, in worker processes for a large batch
+        signatures = Verification.signature_verifier.verify_many([converted[position] for position in new_positions])
+        candidates = [position for position, valid in zip(new_positions, signatures) if valid]
+
+        accepted = []
+        with self.__lock:
+            candidates = [position for position in candidates if converted[position].id() not in self.__mempool]
+            funded = Verification.verify_funds([converted[position] for position in candidates], self.get_balance)
+            evicted = []
+            for position, has_funds in zip(candidates, funded):
+                if not has_funds:
+                    continue
+                results[position] = True
+                evicted += self.__mempool.add(converted[position]) or []
+                self.__seen.add(converted[position].id())
+                accepted.append(position)
+            # one write for the whole batch, a full mempool appends a removal for every dropped transaction
+            # instead of rewriting the file (one dropped in the same batch is not written at all)
+            if accepted:
+                batch_ids = set(converted[position].id() for position in accepted)
+                self.__store.append_transactions(
+                    [converted[position] for position in accepted if converted[position].id() in self.__mempool],
+                    removed=[tx.id() for tx in evicted if tx.id() not in batch_ids])
+                # the removals pile up while the mempool is full, rewriting now and then keeps writes O(1) per transaction
+                if self.__store.mempool_records > MEMPOOL_LOG_COMPACT * len(self.__mempool):
+                    self.__store.save_transactions(self.__mempool.transactions())
+
+        if accepted:
+            self.announce(transactions=[converted[position].id() for position in accepted])
+        return results
+
+    def on_transaction_broadcasted(self, node, response):
+        if response.status_code == 400 or response.status_code == 500:
+            print('Broadcast transaction declined by {}, needs resolving'.format(node))
 
     # core feature of block chain
     # this is how it stores, how to get distributed across network
@@ -187,116 +364,621 @@ class Blockchain:
         """
         take all open_transactions and add to a new block, add to blockchain
         """
-        if self.public_key is None:
+        if self.public_key is None or self.light:
             return None
-        last_block = self.__chain[-1]
-        hashed_block = hash_block(last_block)
+        # the block is put together with the lock held, the proof of work runs without it
+        with self.__lock:
+            hashed_block = self.__chain.block_hash(-1)
+
+            # now we ensure that is not managed globally but locally
+            # could safely do that without risking that open transaction would be affected
+            # transactions which arrive while mining stay open for the next block
+            copied_transactions = self.__mempool.transactions()
+
+            # check all transactions(not include reward transactions) which will be added in next block
+            # signatures checked when the transaction arrived are not checked again
+            if not Verification.verify_transactions(copied_transactions, self.get_balance):
+                return None
+
+            # miner get reward, reward will be sent to the node which did mining
+            # we never verify signature here
+            # the height as nonce, so the reward of every block has its own id
+            reward_transaction = Transaction(sender='MINING', recipient=self.public_key, signature='',
+                                             amount=MINING_REWARD, nonce=len(self.__chain))
+            copied_transactions.append(reward_transaction)  # just add into open transaction
+
+            # the merkle root covers the reward as well, the proof of work is done over the header only
+            block = Block(index=len(self.__chain), previous_hash=hashed_block,
+                          transactions=copied_transactions, proof=0, difficulty=next_difficulty(self.__chain))
+        proof = self.proof_of_work(block)
+        with self.__lock:
+            # cancelled, or another block became the last block while mining
+            if proof is None or self.__chain.block_hash(-1) != hashed_block:
+                return None
+            block.proof = proof
+            self.append_block(block)  # add new block into blockchain
+            self.__mempool.remove_many(copied_transactions)
+            self.__store.save_transactions(self.__mempool.transactions())
+        self.announce(blocks=[hash_block(block)])
+        return block
 
-        # proof of work before adding reward transaction
-        proof = self.proof_of_work()
+    def on_block_broadcasted(self, node, response):
+        if response.status_code == 400 or response.status_code == 500:
+            print('Broadcast block declined by {}, needs resolving'.format(node))
+        if response.status_code == 409:  # 409 means conflict, the peer may have a chain with more work
+            self.request_resolve()
 
-        # miner get reward, reward will be sent to the node which did mining
-        # we never verify signature here
-        reward_transaction = Transaction(sender='MINING', recipient=self.public_key, signature='', amount=MINING_REWARD)
+    def add_block(self, converted_block):  # block object here, from json (Block.from_dict) or binary (utility.codec)
+        """
+        a block from a peer, it does not have to be the next block of our chain:
+        a block for another branch is kept in the block tree and the branch with the most work becomes our chain,
+        a block whose parent we do not know is kept as orphan until the parent arrives (resolve is started to get it)
+        returns what happened to the block, one of the BLOCK_ constants
+        """
+        # proof and merkle root do not depend on our chain, they are checked before taking the lock
+        if not Verification.valid_proof(converted_block) or not Verification.valid_merkle_root(converted_block):
+            return BLOCK_INVALID
+        # a light node only keeps the header, the hash stays the same
+        if self.light:
+            converted_block = Block.from_header(converted_block.header())
+        block_hash = hash_block(converted_block)
+        with self.__lock:
+            tip_hash = self.__chain.block_hash(-1)
+            result = self.insert_block(converted_block, block_hash)
+            # blocks which waited for this one can be placed now, and blocks which waited for those ...
+            placed = []
+            if result in (BLOCK_ADDED, BLOCK_SIDE):
+                placed = [block_hash] + self.place_orphans(block_hash)
+            new_tip = self.__chain.block_hash(-1)
+            if new_tip != tip_hash:
+                # our own proof of work would be for the old last block
+                self.cancel_mining()
+                # a side block whose orphans made its branch the heaviest one is on our chain now
+                if result == BLOCK_SIDE:
+                    result = BLOCK_ADDED
+        if result == BLOCK_ORPHAN:
+            # somebody has the blocks between our chain and this one
+            self.request_resolve()
+        # our peers learn about the blocks from us, so they travel further than the node which mined them,
+        # the orphans placed after this block as well
+        # a light node does not pass blocks on, it could not send their transactions
+        elif placed and not self.light:
+            self.announce(blocks=placed)
+        return result
+
+    def place_orphans(self, parent_hash):
+        """
+        insert the orphans waiting for parent_hash, and the ones waiting for those ..., only called with the lock held
+        returns the hashes of the placed blocks
+        """
+        placed = []
+        waiting = [parent_hash]
+        while waiting:
+            for orphan_hash, orphan in self.__tree.take_orphans(waiting.pop()):
+                if self.insert_block(orphan, orphan_hash) in (BLOCK_ADDED, BLOCK_SIDE):
+                    placed.append(orphan_hash)
+                    waiting.append(orphan_hash)
+        return placed
+
+    def insert_block(self, block, block_hash):
+        """
+        put a block with valid proof and merkle root where it belongs, only called with the lock held
+        the next block of our chain is appended, a block of another branch goes into the block tree
+        and if its branch has more work than our chain from the fork on, the chain switches to it (reorganize)
+        """
+        if block_hash in self.__tree or self.__chain.index_of(block_hash) is not None:
+            return BLOCK_KNOWN
+        if block.timestamp > time() + MAX_CLOCK_DRIFT:
+            return BLOCK_INVALID
+        if block.previous_hash == self.__chain.block_hash(-1):
+            last_block = self.__chain[-1]
+            # difficulty has to be what the retarget says, a peer can not pick an easier one
+            if block.index != len(self.__chain) or block.difficulty != next_difficulty(self.__chain) or \
+                    block.timestamp < last_block.timestamp:
+                return BLOCK_INVALID
+            self.append_block(block)
+            """
+            update open transaction on peer node, when broadcast block to peer node
+            the some open transactions on peer node should be removed because it will be store in new block
+            """
+            # every incoming transaction is looked up by its id, no need to compare it with every open one
+            if self.__mempool.remove_many(block.transactions):
+                self.__store.save_transactions(self.__mempool.transactions())
+            return BLOCK_ADDED
+        branch = self.__tree.branch(block.previous_hash, lambda parent: self.__chain.index_of(parent) is not None)
+        if branch is None:
+            self.__tree.add_orphan(block_hash, block)
+            return BLOCK_ORPHAN
+        branch.append(block)
+        height = branch[0].index  # first block after the fork
+        # blocks without transactions can not be reverted, a fork has to start after them
+        if height < max(self.__store.pruned_height, 1):
+            return BLOCK_INVALID
+        # the blocks before were checked when they came in, their parents do not change
+        candidate = ForkView(self.__chain, height, branch)
+        if not Verification.verify_chain(candidate, start=len(candidate) - 1, headers_only=True):
+            return BLOCK_INVALID
+        self.__tree.add_side(block_hash, block)
+        if chain_work(branch) <= chain_work(self.__chain[height:]):
+            return BLOCK_SIDE
+        self.reorganize(height, branch)
+        return BLOCK_ADDED
+
+    def reorganize(self, height, blocks):
+        """
+        switch our chain to blocks (of a branch which starts at height), only called with the lock held
+        the blocks we leave go into the block tree, their transactions back into the mempool unless the new branch has them
+        """
+        disconnected = self.__chain[height:]
+        self.replace_blocks(height, blocks)
+        # a later block may make the old branch the one with the most work again
+        for block in disconnected:
+            self.__tree.add_side(hash_block(block), block)
+        for block in blocks:
+            self.__tree.remove_side(hash_block(block))
+        print('Switched to a branch with more work at height {}, {} blocks left'.format(height, len(disconnected)))
+        if not self.light:
+            self.return_to_mempool(disconnected, blocks)
+
+    def return_to_mempool(self, disconnected, connected):
+        """
+        after a reorganization: the transactions of the blocks we left are open again, unless the new blocks have them,
+        every open transaction is checked against the new balances, one which can not be paid any more is dropped
+        """
+        in_chain = {tx.id() for block in connected for tx in block.transactions}
+        returned = [tx for block in disconnected for tx in block.transactions
+                    if tx.sender != 'MINING' and tx.id() not in in_chain]
+        # blocks from peers never had their signatures checked by us
+        signatures = Verification.signature_verifier.verify_many(returned)
+        returned = [tx for tx, valid in zip(returned, signatures) if valid]
+        candidates = returned + [tx for tx in self.__mempool.transactions() if tx.id() not in in_chain]
+        self.__mempool.reset()
+        funded = Verification.verify_funds(candidates, self.get_balance)
+        for tx, has_funds in zip(candidates, funded):
+            if has_funds:
+                self.__mempool.add(tx)
+        self.__store.save_transactions(self.__mempool.transactions())
+        # peers on the new branch may never have seen them
+        returned = [tx.id() for tx in returned if tx.id() in self.__mempool]
+        if returned:
+            self.announce(transactions=returned)
+
+    def request_resolve(self):
+        """ run resolve in the background, while one is waiting to run another request does nothing """
+        self.resolve_conflicts = True
+        if self.__resolve_waiting.acquire(blocking=False):
+            self.__resolver.submit(self.resolve_requested)
+
+    def resolve_requested(self):
+        self.__resolve_waiting.release()
+        try:
+            self.resolve()
+        except Exception as error:  # the background thread must not die
+            print('Resolving failed: {}'.format(error))
 
-        # now we ensure that is not managed globally but locally
-        # could safely do that without risking that open transaction would be affected
-        copied_transactions = self.__open_transactions[:]
+    def announce(self, blocks=(), transactions=()):
+        """
+        tell every peer which blocks (hashes) and transactions (ids) we have, a peer answers with the ones
+        it does not have yet (see wanted) and only those are sent, see on_inventory_response
+        """
+        inventory = {'blocks': list(blocks), 'transactions': list(transactions)}
+        metrics.inc('inventory_announced_total', len(inventory['blocks']), kind='block')
+        metrics.inc('inventory_announced_total', len(inventory['transactions']), kind='transaction')
+        self.__broadcaster.broadcast('inv', inventory,
+                                     lambda node, response: self.on_inventory_response(node, response, inventory))
 
-        # loop check all transactions(not include reward transactions) which will be added in next block
-        for tx in copied_transactions:
-            if not Wallet.verify_transaction(tx):
-                return None
-        copied_transactions.append(reward_transaction)  # just add into open transaction
-
-        block = Block(index=len(self.__chain), previous_hash=hashed_block,
-                      transactions=copied_transactions, proof=proof)
-
-        self.__chain.append(block)  # add new block into blockchain
-        self.__open_transactions = []
-        self.save_data()
-        for node in self.__peer_nodes:
-            url = 'http://{}/broadcast-block'.format(node)
-            converted_block = block.__dict__.copy()
-            converted_block['transactions'] = [tx.__dict__ for tx in converted_block['transactions']]
+    def wanted(self, blocks, transactions):
+        """
+        the announced blocks (hashes) and transactions (ids) we neither have nor requested already,
+        they count as requested for REQUEST_TTL seconds, so the same item is not asked from every peer which announces it
+        """
+        wanted_blocks = []
+        for block_hash in blocks:
+            if block_hash not in self.__seen and self.__chain.index_of(block_hash) is None:
+                self.__seen.add(block_hash, REQUEST_TTL)
+                wanted_blocks.append(block_hash)
+        wanted_transactions = []
+        # without balances a light node can not verify transactions, it does not take them
+        if not self.light:
+            for tx_id in transactions:
+                if tx_id not in self.__seen and tx_id not in self.__mempool:
+                    self.__seen.add(tx_id, REQUEST_TTL)
+                    wanted_transactions.append(tx_id)
+        metrics.inc('inventory_requested_total', len(wanted_blocks), kind='block')
+        metrics.inc('inventory_requested_total', len(wanted_transactions), kind='transaction')
+        return {'blocks': wanted_blocks, 'transactions': wanted_transactions}
+
+    def on_inventory_response(self, node, response, inventory):
+        """ send node the items it asked for, a node which does not know /inv (404) gets all of them """
+        if response.status_code == 404:
+            wanted = inventory
+        elif response.status_code == 200:
             try:
-                response = requests.post(url, json={'block': converted_block})
-                if response.status_code == 400 or response.status_code == 500:
-                    print('Broadcast block declined, needs resolving')
-                if response.status_code == 409:  # 409 means conflict
-                    self.resolve_conflicts = True
-            except requests.exceptions.ConnectionError:
+                wanted = response.json()
+            except ValueError:
+                return
+        else:
+            return
+        # blocks first, the transactions may spend what the block paid
+        for block_hash in wanted.get('blocks', []):
+            index = self.__chain.index_of(block_hash)
+            if index is None:
                 continue
-        return block
-
-    def add_block(self, block):  # block is dict here
-        # transactions is a list of transaction object
-        transactions = [Transaction(tx['sender'], tx['recipient'], tx['signature'], tx['amount']) for tx in block['transactions']]
-        proof_is_valid = Verification.valid_proof(transactions[:-1], block['previous_hash'], block['proof'])
-        hashes_match = hash_block(self.chain[-1]) == block['previous_hash']
-        if not proof_is_valid or not hashes_match:
-            return False
-        converted_block = Block(block['index'], block['previous_hash'], transactions, block['proof'], block['timestamp'])
-        self.__chain.append(converted_block)
-
-        """
-        update open transaction on peer node, when broadcast block to peer node
-        the some open transactions on peer node should be removed because it will be store in new block
-        """
-        stored_transactions = self.__open_transactions[:]
-        for itx in block['transactions']:  # itx is incoming tx
-            for opentx in stored_transactions:  # opentx is open transaction of node
-                # for every incoming transaction, check if it is part of my open transaction
-                if opentx.sender == itx['sender'] and opentx.recipient == itx['recipient'] and opentx.amount == itx['amount'] and opentx.signature == itx['signature']:
-                    # if same, try removing it from peer node to prevent encountering second time
-                    try:
-                        self.__open_transactions.remove(opentx)
-                    except ValueError:
-                        print('Item was already removed')
-        self.save_data()
-        return True
+            block = self.__chain[index]
+            # peers which support it get the binary form, see utility.codec
+            self.__broadcaster.send(node, 'broadcast-block', {'block': block.to_dict()}, self.on_block_broadcasted,
+                                    encoded=block_payload(block))
+        transactions = [self.__mempool.get(tx_id) for tx_id in wanted.get('transactions', [])]
+        transactions = [tx.to_dict() for tx in transactions if tx is not None]
+        if transactions:
+            self.__broadcaster.send(node, 'broadcast-transactions', {'transactions': transactions},
+                                    self.on_transaction_broadcasted)
+
+    def get_open_transaction(self, tx_id):
+        """ open transaction (object) with this id, None if it is not in the mempool """
+        return self.__mempool.get(tx_id)
 
     def resolve(self):
-        winner_chain = self.chain
+        """
+        switch to the valid chain of our peers with the most work
+        headers first: only the headers after the last block we have in common are downloaded and verified,
+        the bodies are fetched afterwards, in chunks from several peers at the same time (a light node skips them)
+        runs by itself when a block from a peer does not connect to anything we know, see request_resolve
+        """
+        try:
+            return self.__resolve()
+        finally:
+            # /mine waits for this, a peer which makes resolve fail must not stop us from mining
+            self.resolve_conflicts = False
+
+    def __resolve(self):
+        # peers which are backing off are not asked, the others fastest first
+        peer_nodes = self.__peers.healthy()
+        # ask every peer for the height and the hash of its last block, all at the same time
+        with ThreadPoolExecutor(max_workers=max(1, min(RESOLVE_WORKERS, len(peer_nodes)))) as pool:
+            tips = [tip for tip in pool.map(self.fetch_tip, peer_nodes) if tip is not None]
         replace = False  # whether our current chain is getting replaced, initially is False
-        for node in self.__peer_nodes:
-            url = 'http://{}/chain'.format(node)
+        # longest chain first, a shorter one can still have more work
+        # sorted keeps the order of tips for the same height, so the fastest of them is tried first
+        for tip in sorted(tips, key=lambda tip: tip['height'], reverse=True):
+            # the peer is on our chain, at our last block or behind it
+            if self.__chain.index_of(tip['hash']) is not None:
+                continue
             try:
-                response = requests.get(url)
-                node_chain = response.json()  # list of block dict
-                # create list of block object with a list of dict transaction
-                node_chain = [Block(block['index'],
-                                    block['previous_hash'],
-                                    [Transaction(tx['sender'], tx['recipient'], tx['signature'], tx['amount']) for tx in block['transactions']],
-                                    block['proof'],
-                                    block['timestamp']) for block in node_chain]
-                node_chain_length = len(node_chain)
-                local_chain_length = len(winner_chain)
-                if node_chain_length > local_chain_length and Verification.verify_chain(node_chain):
-                    winner_chain = node_chain
-                    replace = True  # if replace is True, we can assume our transactions are incorrect
-
-            except requests.exceptions.ConnectionError:
+                ancestor = self.find_common_ancestor(tip['node'], tip['height'])
+                # blocks without transactions can not be reverted, a fork has to start after them
+                if ancestor + 1 < self.__store.pruned_height:
+                    continue
+                headers = self.fetch_headers(tip['node'], ancestor + 1, tip['height'])
+            except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+                self.__peers.record_failure(tip['node'])
                 continue
-        self.resolve_conflicts = False
-        self.chain = winner_chain
-        if replace:
-            self.__open_transactions = []  # if chain is replaced, set local open tx to []
-        self.save_data()
+            candidate = ForkView(self.__chain, ancestor + 1, headers)
+            if not headers or chain_work(headers) <= chain_work(self.__chain[ancestor + 1:]) or \
+                    not Verification.verify_chain(candidate, start=ancestor + 1, headers_only=True):
+                continue
+            if self.light:
+                fork_blocks = headers
+            else:
+                # the peer which sent the headers is asked first, every other peer which is far enough may help,
+                # fastest first like tips
+                sources = [tip['node']] + [other['node'] for other in tips
+                                           if other is not tip and other['height'] > ancestor + 1]
+                fork_blocks = self.fetch_bodies(headers, sources)
+            if fork_blocks is None:
+                continue
+            with self.__lock:
+                # our chain may have changed while we were downloading
+                if chain_work(fork_blocks) <= chain_work(self.__chain[ancestor + 1:]) or \
+                        (ancestor >= 0 and self.__chain.block_hash(ancestor) != fork_blocks[0].previous_hash):
+                    continue
+                self.cancel_mining()
+                self.reorganize(ancestor + 1, fork_blocks)
+                # orphans may connect to the new last block
+                placed = [hash_block(block) for block in fork_blocks]
+                placed += self.place_orphans(placed[-1])
+            # our peers may still be on the branch we left, like in add_block they learn about the new one from us
+            if not self.light:
+                self.announce(blocks=placed)
+            replace = True
+            break
         return replace
 
+    def fetch_tip(self, node):
+        """ {'node', 'height', 'hash'} of a peer, None if it does not answer, recorded in the peer manager either way """
+        start = time()
+        try:
+            response = requests.get('http://{}/chain/tip'.format(node), timeout=RESOLVE_TIMEOUT)
+            tip = response.json()
+            tip = {'node': node, 'height': tip['height'], 'hash': tip['hash']}
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+            self.__peers.record_failure(node)
+            return None
+        self.__peers.record_success(node, time() - start, tip['height'])
+        return tip
+
+    def fetch_block_hash(self, node, index):
+        """ hash of the block at index of a peer, ValueError if it does not send one (like a broken response) """
+        response = requests.get('http://{}/chain/hashes'.format(node),
+                                params={'from': index, 'to': index + 1}, timeout=RESOLVE_TIMEOUT)
+        hashes = response.json()
+        # a peer which lost blocks since it told us its height sends an empty list
+        if not isinstance(hashes, list) or len(hashes) != 1:
+            raise ValueError('peer {} sent no hash for block {}'.format(node, index))
+        return hashes[0]
+
+    @staticmethod
+    def read_blocks(response, from_dict):
+        """ block objects of a /chain or /headers response, binary if the peer supports it (utility.codec), json if not """
+        if response.headers.get('Content-Type', '').startswith(MIMETYPE):
+            return decode_block_list(response.content)
+        return [from_dict(block) for block in response.json()]
+
+    def fetch_blocks(self, node, first_index, end=None):
+        """ blocks first_index to end - 1 of a peer (all from first_index on by default), as block objects """
+        params = {'from': first_index} if end is None else {'from': first_index, 'to': end}
+        response = requests.get('http://{}/chain'.format(node), params=params, headers={'Accept': ACCEPT},
+                                timeout=RESOLVE_TIMEOUT)
+        return self.read_blocks(response, Block.from_dict)
+
+    def fetch_headers(self, node, first_index, end):
+        """ headers first_index to end - 1 of a peer as blocks without transactions, HEADERS_PER_REQUEST at a time """
+        headers = []
+        while first_index + len(headers) < end:
+            limit = min(HEADERS_PER_REQUEST, end - first_index - len(headers))
+            response = requests.get('http://{}/headers'.format(node),
+                                    params={'from': first_index + len(headers), 'limit': limit},
+                                    headers={'Accept': ACCEPT}, timeout=RESOLVE_TIMEOUT)
+            page = self.read_blocks(response, Block.from_header)
+            if not page:
+                break
+            headers.extend(page)
+        return headers
+
+    def fetch_bodies(self, headers, sources):
+        """
+        full blocks for verified headers, chunks of BODIES_PER_REQUEST blocks are downloaded from different peers in parallel
+        returns None if a chunk could not be fetched from any of the sources
+        """
+        chunks = [headers[i:i + BODIES_PER_REQUEST] for i in range(0, len(headers), BODIES_PER_REQUEST)]
+        # every chunk starts with another peer, so the load is spread
+        orders = [sources[i % len(sources):] + sources[:i % len(sources)] for i in range(len(chunks))]
+        with ThreadPoolExecutor(max_workers=max(1, min(RESOLVE_WORKERS, len(chunks)))) as pool:
+            bodies = list(pool.map(self.fetch_chunk, chunks, orders))
+        if any(chunk is None for chunk in bodies):
+            return None
+        return [block for chunk in bodies for block in chunk]
+
+    def fetch_chunk(self, headers, sources):
+        """
+        the blocks for a run of headers from the first source which has them
+        a block is only taken if it has the hash of its header and its transactions match the merkle root
+        """
+        for node in sources:
+            start = time()
+            try:
+                blocks = self.fetch_blocks(node, headers[0].index, headers[-1].index + 1)
+            except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+                self.__peers.record_failure(node)
+                continue
+            self.__peers.record_success(node, time() - start)
+            if len(blocks) == len(headers) and \
+                    all(hash_block(block) == hash_block(header) and Verification.valid_merkle_root(block)
+                        for block, header in zip(blocks, headers)):
+                return blocks
+        return None
+
+    def find_common_ancestor(self, node, node_height):
+        """
+        index of the last block we share with a peer, -1 if not even the genesis block is the same
+        blocks are linked by hash, so once a hash differs every later one differs too, and we can bisect
+        """
+        low, high = -1, min(len(self.__chain), node_height) - 1
+        # most of the time the peer is just ahead of us
+        if self.fetch_block_hash(node, high) == self.__chain.block_hash(high):
+            return high
+        high -= 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.fetch_block_hash(node, middle) == self.__chain.block_hash(middle):
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def replace_blocks(self, height, blocks):
+        """ drop our blocks from height on and append blocks, the cost depends on the fork length only """
+        for index in range(len(self.__chain) - 1, height - 1, -1):
+            self.__ledger.revert_block(self.__chain[index])
+            self.unindex_transactions(self.__chain[index])
+            if self.__address_index is not None:
+                self.__address_index.revert_block(self.__chain[index])
+        self.__chain.truncate(height)
+        for block in blocks:
+            self.__chain.append(block, hash_block(block))
+            self.__seen.add(hash_block(block))
+            for tx in block.transactions:
+                self.__seen.add(tx.id())
+            self.__ledger.apply_block(block)
+            self.index_transactions(block)
+            if self.__address_index is not None:
+                self.__address_index.apply_block(block)
+        # the last checkpoint may belong to a dropped block
+        self.save_ledger()
+
+    def get_block(self, index):
+        """ block object at index, None if there is no such block """
+        if not 0 <= index < len(self.__chain):
+            return None
+        return self.__chain[index]
+
+    def get_block_index(self, block_hash):
+        """ index of the block with this hash, None if it is not in our chain """
+        return self.__chain.index_of(block_hash)
+
+    def get_headers(self, start, end):
+        """ headers (dict) of the blocks start to end - 1, ChainChanged if a reorganization replaced some of them """
+        chain = self.__chain.snapshot()
+        return [chain[index].header() for index in range(max(start, 0), min(end, len(chain)))]
+
+    def get_block_hashes(self, start, end):
+        """ hashes of the blocks start to end - 1, read from the block index, ChainChanged like get_headers """
+        chain = self.__chain.snapshot()
+        return [chain.block_hash(index) for index in range(max(start, 0), min(end, len(chain)))]
+
+    def append_block(self, block):
+        """ store a new last block and update the balance index """
+        self.__chain.append(block, hash_block(block))
+        # neither the block nor its transactions are requested again when a peer announces them
+        self.__seen.add(hash_block(block))
+        for tx in block.transactions:
+            self.__seen.add(tx.id())
+        self.__ledger.apply_block(block)
+        self.index_transactions(block)
+        if self.__address_index is not None:
+            self.__address_index.apply_block(block)
+        if len(self.__chain) % LEDGER_CHECKPOINT_INTERVAL == 0:
+            self.save_ledger()
+        # a light node has no balances to put into a snapshot
+        if len(self.__chain) % SNAPSHOT_INTERVAL == 0 and self.__signer is not None and self.public_key is not None \
+                and not self.light:
+            self.save_snapshot()
+
+    def index_transactions(self, block):
+        """ add the transactions of a new block to the transaction index (if it was built already) """
+        if self.__transaction_index is not None:
+            self.add_to_transaction_index(self.__transaction_index, block)
+
+    @staticmethod
+    def add_to_transaction_index(transaction_index, block):
+        # a transaction in two blocks (a reward of a block from before the nonce) keeps its first block,
+        # that block is dropped last, see unindex_transactions
+        for position, tx in enumerate(block.transactions):
+            transaction_index.setdefault(tx.id(), (block.index, position))
+
+    def build_index(self, index, add_block, install):
+        """
+        fill a new, empty index (transaction or address index) with add_block(index, block) for every block,
+        the scan runs without the lock, so intake and mining go on meanwhile;
+        the blocks appended during the scan are added and install(index) is called with the lock held,
+        from then on append_block and replace_blocks keep the index up to date
+        a scan across a reorganization or prune starts over, after INDEX_BUILD_ATTEMPTS the lock is held for it
+        """
+        for attempt in range(INDEX_BUILD_ATTEMPTS):
+            resets = self.__index_resets
+            view = self.__chain.snapshot()
+            scanned = index()
+            try:
+                for block in view:
+                    add_block(scanned, block)
+            except ChainChanged:
+                continue
+            with self.__lock:
+                if view.changed() or resets != self.__index_resets:
+                    continue
+                for block in self.__chain[len(view):]:
+                    add_block(scanned, block)
+                install(scanned)
+                return
+        with self.__lock:
+            scanned = index()
+            for block in self.__chain:
+                add_block(scanned, block)
+            install(scanned)
+
+    def __install_transaction_index(self, transaction_index):
+        self.__transaction_index = transaction_index
+
+    def __install_address_index(self, address_index):
+        self.__address_index = address_index
+
+    def unindex_transactions(self, block):
+        """ remove the transactions of a dropped block, unless they point to another block """
+        if self.__transaction_index is None:
+            return
+        for tx in block.transactions:
+            if self.__transaction_index.get(tx.id(), (None,))[0] == block.index:
+                del self.__transaction_index[tx.id()]
+
+    def get_transaction_proof(self, tx_id):
+        """
+        proof that the transaction is part of our chain: the block header and the merkle path
+        from the transaction id to the merkle root in that header, None if the transaction is unknown
+        """
+        while True:
+            with self.__index_build_lock:
+                if self.__transaction_index is None:
+                    self.build_index(dict, self.add_to_transaction_index, self.__install_transaction_index)
+            # the index and the block it points to have to belong to the same chain
+            with self.__lock:
+                # a prune may have dropped the index right after it was built
+                if self.__transaction_index is None:
+                    continue
+                location = self.__transaction_index.get(tx_id)
+                if location is None:
+                    return None
+                block_index, position = location
+                block = self.__chain[block_index]
+                block_hash = self.__chain.block_hash(block_index)
+            break
+        return {
+            'transaction_id': tx_id,
+            'block_index': block_index,
+            'block_hash': block_hash,
+            'header': block.header(),
+            'position': position,
+            'merkle_path': merkle_path([tx.id() for tx in block.transactions], position)
+        }
+
+    def get_address_history(self, address, start=0, limit=None):
+        """
+        transactions address sent or received, oldest first, from its start-th transaction on
+        returns (total number of its transactions, list of dicts with the block and the transaction),
+        None on a light node, which has no transactions
+        blocks below store.pruned_height have no transactions any more, they are not part of the history
+        """
+        if self.light:
+            return None
+        while True:
+            with self.__index_build_lock:
+                if self.__address_index is None:
+                    self.build_index(AddressIndex, AddressIndex.apply_block, self.__install_address_index)
+            # the index and the blocks it points to have to belong to the same chain
+            with self.__lock:
+                # a prune may have dropped the index right after it was built
+                if self.__address_index is None:
+                    continue
+                history = []
+                for block_index, position in self.__address_index.history(address, start, limit):
+                    tx = self.__chain[block_index].transactions[position]
+                    history.append({
+                        'block_index': block_index,
+                        'block_hash': self.__chain.block_hash(block_index),
+                        'position': position,
+                        'transaction_id': tx.id(),
+                        'transaction': tx.to_dict()
+                    })
+                return self.__address_index.count(address), history
+
     def add_peer_node(self, node):
         """Adds a new node to the peer node set.
         Arguments:
             node: The node URL which should be added.
         """
-        self.__peer_nodes.add(node)
-        self.save_data()
+        self.__peers.add(node)
 
     def remove_peer_node(self, node):
-        self.__peer_nodes.discard(node)
-        self.save_data()
+        self.__peers.remove(node)
+        self.__broadcaster.forget(node)
 
     def get_peer_nodes(self):
         """return a list of all connected peer nodes."""
-        return list(self.__peer_nodes)[:]
+        return self.__peers.nodes()
+
+    def get_healthy_peer_nodes(self):
+        """ peer nodes which are not backing off, fastest first """
+        return self.__peers.healthy()
+
+    def get_peer_stats(self):
+        """ {node: {'rtt', 'failures', 'last_seen', 'height', 'retry_at'}} of every peer, see PeerManager """
+        return self.__peers.state()
@@ -0,0 +1,213 @@
+import threading
+from collections import OrderedDict, deque
+
+
+BLOCK_CACHE_SIZE = 256  # materialized blocks kept in memory, the tip is always among them
+TRUNCATIONS_KEPT = 64  # recent truncations remembered for ChainView, an older view counts as changed
+
+
+class ChainChanged(Exception):
+    """ blocks a ChainView covers were replaced by a reorganization while it was read """
+
+
+class LazyChain:
+    """
+    the chain of a node, backed by the block store
+    only an index is read at startup, a Block object is built from disk the first time
+    somebody asks for it and kept in a small cache, so memory does not grow with the chain
+    """
+    def __init__(self, store):
+        self.__store = store
+        self.__cache = OrderedDict()  # {height: Block}, most recently used last
+        # readers do not hold the Blockchain lock, the cache is shared by all of them and the writer
+        self.__cache_lock = threading.Lock()
+        # increased every time cached blocks are dropped, a block read before that is not cached any more
+        self.__cache_epoch = 0
+        # {block hash (32 raw bytes, half the size of the hex string): height}, built from the index the first
+        # time it is needed, readers do not hold the Blockchain lock so it is built and changed under this one
+        self.__heights = None
+        self.__heights_lock = threading.Lock()
+        # increased by every truncate, a ChainView remembers it to notice blocks replaced under it
+        self.generation = 0
+        self.__truncations = deque(maxlen=TRUNCATIONS_KEPT)  # (generation, height) of the recent truncations
+
+    def __len__(self):
+        return self.__store.height
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[height] for height in range(*index.indices(len(self)))]
+        height = index + len(self) if index < 0 else index
+        with self.__cache_lock:
+            block = self.__cache.get(height)
+            if block is not None:
+                self.__cache.move_to_end(height)
+                return block
+            epoch = self.__cache_epoch
+        # read without the lock, a truncate meanwhile may have replaced the block, then it is not cached
+        block = self.__store.read_block(height)
+        with self.__cache_lock:
+            cached = epoch == self.__cache_epoch
+            if cached:
+                self.__remember(height, block)
+        if cached:
+            self.__intern(block)
+        return block
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
+
+    def __remember(self, height, block):
+        # only called with __cache_lock held
+        self.__cache[height] = block
+        if len(self.__cache) > BLOCK_CACHE_SIZE:
+            self.__cache.popitem(last=False)
+
+    @staticmethod
+    def __intern(block):
+        """
+        blocks of our chain were verified, the cached ones share their addresses (AddressTable)
+        a block read from disk already shares them within the block, see utility.codec
+        """
+        for tx in block.transactions:
+            tx.intern()
+
+    def block_hash(self, index):
+        """ hash of a block, read from the index without building the block """
+        return self.__store.block_hash(index + len(self) if index < 0 else index)
+
+    def index_of(self, block_hash):
+        """ height of the block with this hash, None if it is not in the chain """
+        try:
+            key = bytes.fromhex(block_hash)
+        except (TypeError, ValueError):
+            return None
+        with self.__heights_lock:
+            if self.__heights is None:
+                # an append waits for the build, so no block is missed
+                self.__heights = {bytes.fromhex(stored_hash): height
+                                  for height, stored_hash in enumerate(self.__store.block_hashes())}
+            return self.__heights.get(key)
+
+    def append(self, block, block_hash):
+        if self.__store.append_block(block, block_hash):
+            self.__intern(block)
+            with self.__cache_lock:
+                self.__remember(len(self) - 1, block)
+            with self.__heights_lock:
+                if self.__heights is not None:
+                    self.__heights[bytes.fromhex(block_hash)] = len(self) - 1
+
+    def truncate(self, height):
+        """ drop every block from height on """
+        # recorded before the store changes, so a reader which got a replaced block sees it afterwards
+        self.__truncations.append((self.generation + 1, height))
+        self.generation += 1
+        with self.__heights_lock:
+            if self.__heights is not None:
+                for index in range(height, len(self)):
+                    self.__heights.pop(bytes.fromhex(self.__store.block_hash(index)), None)
+            self.__store.truncate(height)
+        # after the store changed, a reader which read a dropped block before can not cache it any more
+        with self.__cache_lock:
+            for cached_height in [h for h in self.__cache if h >= height]:
+                del self.__cache[cached_height]
+            self.__cache_epoch += 1
+
+    def clear_cache(self):
+        """ forget the materialized blocks, e.g. after the store dropped their transactions """
+        with self.__cache_lock:
+            self.__cache.clear()
+            self.__cache_epoch += 1
+
+    def changed_since(self, generation, height):
+        """ True if the block at height was dropped by a truncate after generation """
+        if generation == self.generation:
+            return False
+        truncations = list(self.__truncations)
+        # the truncations right after generation are forgotten, we can not tell
+        if not truncations or truncations[0][0] > generation + 1:
+            return True
+        return any(truncated_generation > generation and truncated_height <= height
+                   for truncated_generation, truncated_height in truncations)
+
+    def snapshot(self):
+        generation = self.generation
+        return ChainView(self, len(self), generation)
+
+
+class ChainView:
+    """
+    read-only view of the first length blocks of a LazyChain
+    this is what Blockchain.chain hands out instead of copying every block
+    readers do not take the lock, if a reorganization replaces blocks of the view while it is read
+    ChainChanged is raised instead of mixing blocks of two branches (or running past a shorter chain)
+    """
+    def __init__(self, chain, length, generation):
+        self.__chain = chain
+        self.__length = length
+        self.__generation = generation
+
+    def __len__(self):
+        return self.__length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[height] for height in range(*index.indices(self.__length))]
+        return self.__read(index, self.__chain.__getitem__)
+
+    def __iter__(self):
+        for height in range(self.__length):
+            yield self[height]
+
+    def block_hash(self, index):
+        return self.__read(index, self.__chain.block_hash)
+
+    def changed(self):
+        """ True if a reorganization replaced a block of the view since it was made """
+        return self.__length > 0 and self.__chain.changed_since(self.__generation, self.__length - 1)
+
+    def __read(self, index, read):
+        height = index + self.__length if index < 0 else index
+        if not 0 <= height < self.__length:
+            raise IndexError('block index out of range')
+        try:
+            value = read(height)
+        except (IndexError, ValueError):
+            # the chain got shorter or the record is being replaced
+            if self.__chain.changed_since(self.__generation, height):
+                raise ChainChanged('block {} was replaced while the chain was read'.format(height))
+            raise
+        # checked after reading, a block read after the truncation is caught as well
+        if self.__chain.changed_since(self.__generation, height):
+            raise ChainChanged('block {} was replaced while the chain was read'.format(height))
+        return value
+
+
+class ForkView:
+    """
+    the first height blocks of chain followed by the blocks of a fork (list of block object),
+    lets a fork be verified against our own blocks without copying them
+    """
+    def __init__(self, chain, height, fork_blocks):
+        self.__chain = chain
+        self.__height = height
+        self.__fork_blocks = fork_blocks
+
+    def __len__(self):
+        return self.__height + len(self.__fork_blocks)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[height] for height in range(*index.indices(len(self)))]
+        height = index + len(self) if index < 0 else index
+        if not 0 <= height < len(self):
+            raise IndexError('block index out of range')
+        if height < self.__height:
+            return self.__chain[height]
+        return self.__fork_blocks[height - self.__height]
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self[height]
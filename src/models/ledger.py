@@ -0,0 +1,32 @@
+class Ledger:
+    """
+    Per-address balance index for the blockchain.
+    confirmed balances are updated block by block as the chain grows,
+    so a balance lookup is a dict access instead of a scan over every block
+    (open transactions are counted by the Mempool)
+    """
+    def __init__(self):
+        self.__confirmed = {}  # {public_key: amount_received - amount_sent}, only mined blocks
+
+    def balances(self):
+        """ copy of the confirmed balances, used for checkpoints """
+        return dict(self.__confirmed)
+
+    def restore(self, balances):
+        self.__confirmed = dict(balances)
+
+    def apply_block(self, block):
+        """ add the effect of a newly appended block """
+        for tx in block.transactions:
+            self.__confirmed[tx.sender] = self.__confirmed.get(tx.sender, 0) - tx.amount
+            self.__confirmed[tx.recipient] = self.__confirmed.get(tx.recipient, 0) + tx.amount
+
+    def revert_block(self, block):
+        """ undo apply_block, for blocks which are dropped from the end of the chain """
+        for tx in block.transactions:
+            self.__confirmed[tx.sender] = self.__confirmed.get(tx.sender, 0) + tx.amount
+            self.__confirmed[tx.recipient] = self.__confirmed.get(tx.recipient, 0) - tx.amount
+
+    def balance(self, participant):
+        """ amount_received - amount_sent in mined blocks """
+        return self.__confirmed.get(participant, 0)
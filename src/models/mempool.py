@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+
+MEMPOOL_MAX_SIZE = 10000  # open transactions kept, the oldest one is dropped when a new one does not fit
+
+
+class Mempool:
+    """
+    open transactions (not mined yet), keyed by transaction id (Transaction.id)
+    adding, finding a duplicate and removing a transaction cost the same no matter how many are open
+    the amount every sender has in open transactions is kept up to date for the funds check
+    """
+    def __init__(self, max_size=MEMPOOL_MAX_SIZE):
+        self.max_size = max_size
+        self.__transactions = OrderedDict()  # {tx id: transaction}, oldest first
+        self.__by_sender = {}  # {sender: set of tx id}
+        self.__pending_sent = {}  # {sender: amount sent in open transactions}
+        # counts changes, a reader can tell whether its copy of the transactions is still current
+        self.version = 0
+
+    def __len__(self):
+        return len(self.__transactions)
+
+    def __contains__(self, tx_id):
+        return tx_id in self.__transactions
+
+    def get(self, tx_id):
+        return self.__transactions.get(tx_id)
+
+    def transactions(self):
+        """ list of the open transactions, oldest first """
+        return list(self.__transactions.values())
+
+    def pending_sent(self, sender):
+        """ amount sender already spends in open transactions """
+        return self.__pending_sent.get(sender, 0)
+
+    def add(self, transaction):
+        """
+        returns the transactions which were dropped to make room (oldest first),
+        None if the transaction is already open
+        """
+        tx_id = transaction.id()
+        if tx_id in self.__transactions:
+            return None
+        evicted = []
+        while len(self.__transactions) >= self.max_size:
+            evicted.append(self.remove(next(iter(self.__transactions))))
+        # only verified transactions get here, they may share their addresses with the others
+        transaction.intern()
+        self.__transactions[tx_id] = transaction
+        self.version += 1
+        self.__by_sender.setdefault(transaction.sender, set()).add(tx_id)
+        self.__pending_sent[transaction.sender] = self.pending_sent(transaction.sender) + transaction.amount
+        return evicted
+
+    def remove(self, tx_id):
+        """ the removed transaction, None if it was not open """
+        transaction = self.__transactions.pop(tx_id, None)
+        if transaction is None:
+            return None
+        self.version += 1
+        sender_ids = self.__by_sender[transaction.sender]
+        sender_ids.discard(tx_id)
+        if sender_ids:
+            self.__pending_sent[transaction.sender] -= transaction.amount
+        else:
+            # no rounding leftovers for a sender without open transactions
+            del self.__by_sender[transaction.sender]
+            del self.__pending_sent[transaction.sender]
+        return transaction
+
+    def remove_many(self, transactions):
+        """ remove every transaction which is open, returns how many were removed """
+        return sum(1 for tx in transactions if self.remove(tx.id()) is not None)
+
+    def reset(self, transactions=()):
+        self.__transactions.clear()
+        self.__by_sender.clear()
+        self.__pending_sent.clear()
+        self.version += 1
+        for tx in transactions:
+            self.add(tx)
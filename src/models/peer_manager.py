@@ -0,0 +1,121 @@
+import threading
+from time import time
+
+
+CONNECT_TIMEOUT = 1  # seconds to open a connection to a peer, a dead peer fails fast
+RTT_WEIGHT = 0.2  # weight of a new round trip time in the moving average
+BACKOFF_BASE = 1  # seconds a peer is skipped after its second failure in a row, doubled for every further one
+BACKOFF_MAX = 10 * 60
+MAX_FAILURES = 10  # failures in a row after which a peer is removed
+SAVE_INTERVAL = 30  # seconds between two saves of the statistics, adding or removing a peer is saved at once
+
+
+class PeerManager:
+    """
+    the peer nodes of a node with what we know about them: round trip time, failures in a row,
+    when they last answered and the chain height they told us
+    a peer which does not answer is skipped for a while (backoff) and removed after MAX_FAILURES,
+    the others are handed out fastest first, so broadcasts and syncing do not wait for the slowest peer
+    """
+    def __init__(self, save=None, on_evict=None):
+        self.__peers = {}  # {node: {'rtt', 'failures', 'last_seen', 'height', 'retry_at'}}
+        self.__lock = threading.Lock()
+        # save(state) writes the state (a dict) to disk, on_evict(node) is called for a removed peer
+        self.__save = save
+        self.__save_lock = threading.Lock()
+        self.__saved_at = 0
+        self.on_evict = on_evict
+
+    def restore(self, state):
+        """ state as saved, the old peers.json (a list of nodes) is taken as well """
+        with self.__lock:
+            if isinstance(state, list):
+                state = {node: {} for node in state}
+            self.__peers = {node: self.__new_peer(stats) for node, stats in state.items()}
+
+    @staticmethod
+    def __new_peer(stats=None):
+        peer = {'rtt': None, 'failures': 0, 'last_seen': None, 'height': None, 'retry_at': 0}
+        peer.update({key: value for key, value in (stats or {}).items() if key in peer})
+        return peer
+
+    def state(self):
+        with self.__lock:
+            return {node: dict(peer) for node, peer in self.__peers.items()}
+
+    def save(self, force=True):
+        """ without force only if the last save is SAVE_INTERVAL seconds ago """
+        if self.__save is None or (not force and time() - self.__saved_at < SAVE_INTERVAL):
+            return
+        # two threads must not write the file at the same time
+        with self.__save_lock:
+            self.__saved_at = time()
+            self.__save(self.state())
+
+    def add(self, node):
+        with self.__lock:
+            if node in self.__peers:
+                return
+            self.__peers[node] = self.__new_peer()
+        self.save()
+
+    def remove(self, node):
+        with self.__lock:
+            removed = self.__peers.pop(node, None) is not None
+        if removed:
+            self.save()
+        return removed
+
+    def nodes(self):
+        """ every peer, healthy or not """
+        with self.__lock:
+            return list(self.__peers)
+
+    def available(self, node):
+        with self.__lock:
+            peer = self.__peers.get(node)
+            return peer is not None and peer['retry_at'] <= time()
+
+    def healthy(self):
+        """ peers which are not backing off, fastest first, the ones we never measured after the measured ones """
+        now = time()
+        with self.__lock:
+            nodes = [(peer['rtt'] is None, peer['rtt'] or 0, node) for node, peer in self.__peers.items()
+                     if peer['retry_at'] <= now]
+        return [node for _, _, node in sorted(nodes)]
+
+    def record_success(self, node, rtt, height=None):
+        """ node answered after rtt seconds, height is the chain height it told us (if it did) """
+        with self.__lock:
+            peer = self.__peers.get(node)
+            if peer is None:
+                return
+            peer['rtt'] = rtt if peer['rtt'] is None else (1 - RTT_WEIGHT) * peer['rtt'] + RTT_WEIGHT * rtt
+            peer['failures'] = 0
+            peer['retry_at'] = 0
+            peer['last_seen'] = time()
+            if height is not None:
+                peer['height'] = height
+        self.save(force=False)
+
+    def record_failure(self, node):
+        """
+        node did not answer, from the second failure in a row on it is skipped for a while,
+        after MAX_FAILURES it is removed, returns True if it was removed
+        """
+        with self.__lock:
+            peer = self.__peers.get(node)
+            if peer is None:
+                return False
+            peer['failures'] += 1
+            evicted = peer['failures'] >= MAX_FAILURES
+            if evicted:
+                del self.__peers[node]
+            elif peer['failures'] >= 2:
+                peer['retry_at'] = time() + min(BACKOFF_BASE * 2 ** (peer['failures'] - 2), BACKOFF_MAX)
+        if evicted:
+            print('Peer {} removed after {} failures'.format(node, MAX_FAILURES))
+            if self.on_evict is not None:
+                self.on_evict(node)
+        self.save(force=evicted)
+        return evicted
@@ -1,14 +1,104 @@
+import random
 from collections import OrderedDict
 from utility.printable import Printable
+from utility.hash_util import canonical_transaction, transaction_id
+from models.address_table import addresses
+
+
+NONCE_BITS = 48  # random nonces below 2 ** 48, still exact in the javascript of the web page
 
 
 class Transaction(Printable):
-    """A transaction which can be added to a block in the blockchain"""
-    def __init__(self, sender, recipient, signature, amount):
-        self.sender = sender
-        self.recipient = recipient
-        self.amount = amount
-        self.signature = signature
+    """
+    A transaction which can be added to a block in the blockchain
+    sender and recipient share their strings with other transactions once verified (intern), the signature is raw bytes
+    a transaction does not change once it is created, so its canonical form is computed only once
+    signatures are deterministic, the nonce is what makes two payments of the same amount to the same recipient
+    two transactions (with their own ids), it is signed with the other fields,
+    transactions made before it existed have none (None) and keep their ids
+    """
+    __slots__ = ('__sender', '__recipient', '__amount', '__signature', '__nonce', '__canonical', '__id')
+
+    def __init__(self, sender, recipient, signature, amount, nonce=None):
+        self.__sender = sender
+        self.__recipient = recipient
+        self.__amount = amount
+        self.__nonce = nonce
+        # hex is twice as long as the bytes, keep the text only if it would not come back the same
+        if type(signature) is bytes:
+            self.__signature = signature  # already raw, e.g. decoded by utility.codec
+        else:
+            try:
+                raw_signature = bytes.fromhex(signature)
+                self.__signature = raw_signature if raw_signature.hex() == signature else signature
+            except (TypeError, ValueError):
+                self.__signature = signature
+        self.__canonical = None
+        self.__id = None
+
+    @property
+    def sender(self):
+        return self.__sender
+
+    @property
+    def recipient(self):
+        return self.__recipient
+
+    def intern(self):
+        """ share sender and recipient with the other verified transactions, see AddressTable """
+        self.__sender = addresses.intern(self.__sender)
+        self.__recipient = addresses.intern(self.__recipient)
+
+    @property
+    def amount(self):
+        return self.__amount
+
+    @property
+    def nonce(self):
+        return self.__nonce
+
+    @staticmethod
+    def new_nonce():
+        """ nonce for a new payment """
+        return random.getrandbits(NONCE_BITS)
+
+    @property
+    def signature(self):
+        """ hex string, as it was given """
+        if type(self.__signature) is bytes:
+            return self.__signature.hex()
+        return self.__signature
+
+    @property
+    def raw_signature(self):
+        """ the signature as it is kept, bytes (or the text if it is not hex) """
+        return self.__signature
 
     def to_ordered_dict(self):
-        return OrderedDict([('sender', self.sender), ('recipient', self.recipient), ('amount', self.amount)])
+        fields = OrderedDict([('sender', self.sender), ('recipient', self.recipient), ('amount', self.amount)])
+        if self.nonce is not None:
+            fields['nonce'] = self.nonce
+        return fields
+
+    def canonical(self):
+        """ json text of to_ordered_dict() with sorted keys, used for block hashes, computed once """
+        if self.__canonical is None:
+            self.__canonical = canonical_transaction(self)
+        return self.__canonical
+
+    def id(self):
+        """ transaction id (see transaction_id), computed once """
+        if self.__id is None:
+            self.__id = transaction_id(self)
+        return self.__id
+
+    def to_dict(self):
+        """ json serializable form, including signature """
+        tx = {'sender': self.sender, 'recipient': self.recipient, 'amount': self.amount, 'signature': self.signature}
+        if self.nonce is not None:
+            tx['nonce'] = self.nonce
+        return tx
+
+    @classmethod
+    def from_dict(cls, tx):
+        return cls(tx['sender'], tx['recipient'], tx['signature'], tx['amount'], tx.get('nonce'))
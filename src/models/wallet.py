@@ -1,16 +1,106 @@
 
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import DSS, PKCS1_v1_5, eddsa
 from Crypto.Hash import SHA256
 import Crypto.Random
 import binascii  # convert binary data into string
+import functools
+
+from utility.worker_pool import WorkerPool
+
+PUBLIC_KEY_CACHE_SIZE = 1024
+PRIVATE_KEY_CACHE_SIZE = 16
+
+"""
+signature schemes a wallet can use, the keys are stored the same way (hex DER) for all of them,
+so the scheme of a key is found by parsing it and nodes verify every scheme
+    rsa      RSA 1024, PKCS#1 v1.5 over SHA256, the default
+    ecdsa    ECDSA on P-256 over SHA256, deterministic signatures (RFC 6979)
+    ed25519  Ed25519, signs about four times faster than rsa and its public keys (addresses) are a quarter as long,
+             verifying is slower than rsa
+"""
+SCHEMES = ('rsa', 'ecdsa', 'ed25519')
+
+
+def import_key(key):
+    """ parsed RSA or ECC key of a hex DER key, public or private """
+    der = binascii.unhexlify(key)
+    try:
+        return RSA.importKey(der)
+    except ValueError:
+        return ECC.import_key(der)
+
+
+@functools.lru_cache(maxsize=PUBLIC_KEY_CACHE_SIZE)
+def import_public_key(public_key):
+    """ parsed key of a hex public key (sender), parsed once per sender """
+    return import_key(public_key)
+
+
+@functools.lru_cache(maxsize=PRIVATE_KEY_CACHE_SIZE)
+def import_private_key(private_key):
+    """ parsed key of a hex private key, parsing takes much longer than signing, so it is done once per process """
+    return import_key(private_key)
+
+
+def key_scheme(key):
+    """ 'rsa', 'ecdsa' or 'ed25519' of a parsed key """
+    if isinstance(key, RSA.RsaKey):
+        return 'rsa'
+    return 'ed25519' if key.curve == 'Ed25519' else 'ecdsa'
+
+
+def transaction_message(sender, recipient, amount, nonce=None):
+    """ what the sender signs, a transaction without nonce signs what it always did """
+    message = str(sender) + str(recipient) + str(amount)
+    if nonce is not None:
+        message += ':' + str(nonce)
+    return message.encode('utf8')
+
+
+def sign(key, message):
+    """ raw signature of message (bytes) with a parsed private key """
+    scheme = key_scheme(key)
+    if scheme == 'rsa':
+        return PKCS1_v1_5.new(key).sign(SHA256.new(message))
+    if scheme == 'ecdsa':
+        return DSS.new(key, 'deterministic-rfc6979').sign(SHA256.new(message))
+    # Ed25519 hashes the message itself
+    return eddsa.new(key, 'rfc8032').sign(message)
+
+
+def verify(key, message, signature):
+    """ True if signature (bytes) of message was made with the private key of the parsed public key """
+    scheme = key_scheme(key)
+    if scheme == 'rsa':
+        return PKCS1_v1_5.new(key).verify(SHA256.new(message), signature)
+    try:
+        if scheme == 'ecdsa':
+            DSS.new(key, 'fips-186-3').verify(SHA256.new(message), signature)
+        else:
+            eddsa.new(key, 'rfc8032').verify(message, signature)
+        return True
+    except ValueError:  # DSS and eddsa raise instead of returning False
+        return False
+
+
+def sign_payment(private_key, sender, recipient, amount, nonce=None):
+    """ hex signature of a transaction, runs in a worker process for large batches (the key is parsed once there) """
+    signature = sign(import_private_key(private_key), transaction_message(sender, recipient, amount, nonce))
+    return binascii.hexlify(signature).decode('ascii')
 
 
 class Wallet:
-    def __init__(self, node_id):
+    def __init__(self, node_id, scheme='rsa', workers=None):
         self.private_key = None
         self.public_key = None
         self.node_id = node_id
+        # used for new keys, loaded keys keep the scheme they were made with (see SCHEMES)
+        if scheme not in SCHEMES:
+            raise ValueError('unknown signature scheme {}'.format(scheme))
+        self.scheme = scheme
+        # large batches are signed by a pool of worker processes, see sign_transactions
+        self.__pool = WorkerPool(workers)
 
     def create_keys(self):
         private_key, public_key = self.generate_keys()
@@ -37,38 +127,59 @@ class Wallet:
                 private_key = keys[1]
                 self.public_key = public_key
                 self.private_key = private_key
+                self.scheme = key_scheme(import_private_key(private_key))
             return True
-        except (IOError, IndexError):
+        except (IOError, IndexError, ValueError):
             print('Loading wallet failed...')
             return False
 
     def generate_keys(self):
-        private_key = RSA.generate(1024, Crypto.Random.new().read)
-        public_key = private_key.publickey()
-        return (binascii.hexlify(private_key.exportKey(format='DER')).decode('ascii'),
-                binascii.hexlify(public_key.exportKey(format='DER')).decode('ascii'))
+        if self.scheme == 'rsa':
+            private_key = RSA.generate(1024, Crypto.Random.new().read)
+            public_key = private_key.publickey()
+            return (binascii.hexlify(private_key.exportKey(format='DER')).decode('ascii'),
+                    binascii.hexlify(public_key.exportKey(format='DER')).decode('ascii'))
+        private_key = ECC.generate(curve='P-256' if self.scheme == 'ecdsa' else 'Ed25519')
+        return (binascii.hexlify(private_key.export_key(format='DER')).decode('ascii'),
+                binascii.hexlify(private_key.public_key().export_key(format='DER')).decode('ascii'))
     """
     pass private_key to signer
     pass public_key to verifier
     """
-    def sign_transaction(self, sender, recipient, amount):
-        # binascii.unhexlify can convert sting to binary
-        # signer to sign transaction
-        signer = PKCS1_v1_5.new(RSA.importKey(binascii.unhexlify(self.private_key)))
-        # encode can encode it to binary string
-        h = SHA256.new((str(sender) + str(recipient) + str(amount)).encode('utf8'))
-        signature = signer.sign(h)
-        # decode into string
-        return binascii.hexlify(signature).decode('ascii')  # this is signature string
+    def sign_transaction(self, sender, recipient, amount, nonce=None):
+        # the private key is parsed once and cached, see import_private_key
+        return sign_payment(self.private_key, sender, recipient, amount, nonce)  # this is signature string
+
+    def sign_transactions(self, payments, sender=None):
+        """
+        hex signatures of a list of (recipient, amount, nonce) sent by sender (our public key by default),
+        in the same order
+        large batches are split over a pool of worker processes (utility.worker_pool)
+        """
+        sender = self.public_key if sender is None else sender
+        payments = list(payments)
+        count = len(payments)
+        return self.__pool.map(sign_payment, [self.private_key] * count, [sender] * count,
+                               [recipient for recipient, _, _ in payments], [amount for _, amount, _ in payments],
+                               [nonce for _, _, nonce in payments])
+
+    def sign_message(self, message):
+        """ signature (hex string) of any bytes, e.g. a snapshot """
+        return binascii.hexlify(sign(import_private_key(self.private_key), message)).decode('ascii')
+
+    @staticmethod
+    def verify_message(public_key, message, signature):
+        return verify(import_public_key(public_key), message, binascii.unhexlify(signature))
 
     @staticmethod  # we don't access class here
     def verify_transaction(transaction):
 
-        # use binascii.unhexlify to convert string to binary
-        public_key = RSA.importKey(binascii.unhexlify(transaction.sender))  # transaction.sender is public_key
-        # verifier to verify transaction
-        verifier = PKCS1_v1_5.new(public_key)  # public_key is binary here
-        h = SHA256.new((str(transaction.sender) + str(transaction.recipient) + str(transaction.amount)).encode('utf8'))
-        # use binascii.unhexlify to convert it from string to binary
-        # the signature here is what we want to verify
-        return verifier.verify(h, binascii.unhexlify(transaction.signature))
+        # use binascii.unhexlify to convert string to binary, the parsed key is cached
+        public_key = import_public_key(transaction.sender)  # transaction.sender is public_key
+        message = transaction_message(transaction.sender, transaction.recipient, transaction.amount,
+                                      transaction.nonce)
+        # the signature here is what we want to verify, usually kept as bytes already
+        signature = transaction.raw_signature
+        if type(signature) is not bytes:
+            signature = binascii.unhexlify(signature)
+        return verify(public_key, message, signature)
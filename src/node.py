@@ -1,15 +1,47 @@
-from flask import Flask, jsonify, request, send_from_directory
+import json
+
+from flask import Flask, Response, jsonify, request, send_from_directory
 # only clients running on same server can access this server
 # only web pages html returned by a server can again send requests to it
 from flask_cors import CORS  # Cross-Origin Resource Sharing
 
-from models.wallet import Wallet
-from models.blockchain import Blockchain
+from models.wallet import SCHEMES, Wallet
+from models.block import Block
+from models.transaction import Transaction
+from models.blockchain import Blockchain, BLOCK_ADDED, BLOCK_KNOWN, BLOCK_ORPHAN, BLOCK_SIDE
+from models.lazy_chain import ChainChanged
+from utility.codec import CODEC_HEADER, FORMAT_VERSION, MIMETYPE, block_from_payload, encode_block_list
+from utility.metrics import metrics
+from utility.profiler import profiler
+
+ADDRESS_PAGE_LIMIT = 100  # transactions per page of /address/<address>/transactions
 
 app = Flask(__name__, static_url_path='/static')
 CORS(app)
 
 
+@app.after_request
+def advertise_codec(response):
+    """ tells peers we read and write the binary form of blocks (utility.codec) """
+    response.headers[CODEC_HEADER] = str(FORMAT_VERSION)
+    return response
+
+
+def wants_binary():
+    """ the client asked for the binary form with Accept, json stays the default """
+    return MIMETYPE in request.headers.get('Accept', '')
+
+
+@app.errorhandler(ChainChanged)
+def chain_changed(error):
+    """
+    a reorganization replaced blocks while a request read them, the client should ask again
+    a streamed response (/chain, /headers) is cut off instead, it never mixes blocks of two branches
+    """
+    response = {'message': 'The chain changed while it was read, try again.'}
+    return jsonify(response), 503
+
+
 # pass path and type of request
 @app.route('/', methods=['GET'])
 def get_node_ui():
@@ -25,8 +57,8 @@ def get_network_ui():
 def create_keys():
     wallet.create_keys()
     if wallet.save_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        # the node keeps its blockchain (one writer, one store), only the key which gets the rewards changes
+        blockchain.public_key = wallet.public_key
         response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
@@ -43,8 +75,8 @@ def create_keys():
 @app.route('/wallet', methods=['GET'])
 def load_keys():
     if wallet.load_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        # the node keeps its blockchain (one writer, one store), only the key which gets the rewards changes
+        blockchain.public_key = wallet.public_key
         response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
@@ -85,9 +117,9 @@ def broadcast_transaction():
     if not all(key in values for key in required):
         response = {'message': 'Some data is missing.'}
         return jsonify(response), 400
+    # announced to our peers as well, see Blockchain.announce
     success = blockchain.add_transaction(values['recipient'], values['sender'],
-                                         values['signature'], values['amount'],
-                                         is_receiving=True)  # we won't broadcast to peer nodes
+                                         values['signature'], values['amount'], values.get('nonce'))
     if success:
         response = {
             'message': 'Successfully added transaction.',
@@ -95,7 +127,8 @@ def broadcast_transaction():
                 'sender': values['sender'],
                 'recipient': values['recipient'],
                 'amount': values['amount'],
-                'signature': values['signature']
+                'signature': values['signature'],
+                'nonce': values.get('nonce')
             }
         }
         return jsonify(response), 201
@@ -106,34 +139,88 @@ def broadcast_transaction():
         return jsonify(response), 500
 
 
+@app.route('/broadcast-transactions', methods=['POST'])
+def broadcast_transactions():
+    """ a batch of transactions from a peer, see /transactions/batch """
+    values = request.get_json()
+    if not values or not isinstance(values.get('transactions'), list):
+        response = {'message': 'No data found.'}
+        return jsonify(response), 400
+    required = ['sender', 'recipient', 'amount', 'signature']
+    if not all(key in tx for tx in values['transactions'] for key in required):
+        response = {'message': 'Some data is missing.'}
+        return jsonify(response), 400
+    results = blockchain.add_transactions(values['transactions'])  # announced to our peers as well
+    response = {
+        'message': 'Added {} of {} transactions.'.format(sum(results), len(results)),
+        'results': results
+    }
+    # some transactions failed, may be a problem with the node this is coming from
+    return jsonify(response), 201 if all(results) else 500
+
+
 @app.route('/broadcast-block', methods=['POST'])
 def broadcast_block():
+    # a peer which saw our CODEC_HEADER sends the block in binary, any other one as json
+    if request.mimetype == MIMETYPE:
+        try:
+            block = block_from_payload(request.get_data())
+        except ValueError:
+            response = {'message': 'Block could not be decoded.'}
+            return jsonify(response), 400
+    else:
+        values = request.get_json()
+        if not values:
+            response = {'message': 'No data found.'}
+            return jsonify(response), 400
+        if 'block' not in values:
+            response = {'message': 'Some data is missing.'}
+            return jsonify(response), 400
+        block = Block.from_dict(values['block'])
+    # the block does not have to be our next block, see Blockchain.add_block
+    result = blockchain.add_block(block)
+    if result == BLOCK_ADDED or result == BLOCK_KNOWN:
+        response = {'message': 'Block added'}
+        return jsonify(response), 201
+    elif result == BLOCK_ORPHAN:
+        response = {'message': 'Block kept until its parent arrives, resolving.'}
+        return jsonify(response), 202
+    elif result == BLOCK_SIDE:
+        # the peer should take our chain, it has more work
+        response = {'message': 'Block kept on a side branch, our chain has more work.'}
+        return jsonify(response), 409
+    else:
+        response = {'message': 'Block seems invalid.'}
+        return jsonify(response), 409
+
+
+@app.route('/inv', methods=['POST'])
+def receive_inventory():
+    """
+    a peer announces {"blocks": [block hash], "transactions": [transaction id]},
+    we answer with the ones we want and it sends those to /broadcast-block and /broadcast-transactions
+    """
     values = request.get_json()
     if not values:
         response = {'message': 'No data found.'}
         return jsonify(response), 400
-    if 'block' not in values:
-        response = {'message': 'Some data is missing.'}
+    blocks = values.get('blocks', [])
+    transactions = values.get('transactions', [])
+    if not isinstance(blocks, list) or not isinstance(transactions, list) or \
+            not all(isinstance(item, str) for item in blocks + transactions):
+        response = {'message': 'Inventory is invalid.'}
         return jsonify(response), 400
-    block = values['block']
-    # in this case, we can start broadcast block
-    if block['index'] == blockchain.chain[-1].index + 1:
-        if blockchain.add_block(block):
-            response = {'message': 'Block added'}
-            return jsonify(response), 201
-        else:
-            response = {'message': 'Block seems invalid.'}
-            return jsonify(response), 409
-
-    # some block are missing
-    elif block['index'] > blockchain.chain[-1].index:
-        response = {'message': 'Blockchain seems to be differ from local blockchain.'}
-        blockchain.resolve_conflicts = True  # for that peer node
-        return jsonify(response), 200
-    # incoming block is wrong
-    else:
-        response = {'message': 'Blockchain seems to be shorter, block not added'}
-        return jsonify(response), 409  # data you sent is invalid
+    return jsonify(blockchain.wanted(blocks, transactions)), 200
+
+
+@app.route('/transaction/<tx_id>', methods=['GET'])
+def get_transaction(tx_id):
+    """ an open transaction by its id """
+    transaction = blockchain.get_open_transaction(tx_id)
+    if transaction is None:
+        response = {'message': 'Transaction not found.'}
+        return jsonify(response), 404
+    return jsonify(transaction.to_dict()), 200
 
 
 # add single transaction
@@ -160,8 +247,10 @@ def add_transaction():
         return jsonify(response), 400
     recipient = values['recipient']
     amount = values['amount']
-    signature = wallet.sign_transaction(sender=wallet.public_key, recipient=recipient, amount=amount)
-    success = blockchain.add_transaction(recipient, wallet.public_key, signature, amount)
+    # every payment gets its own nonce, paying the same amount to the same recipient again is a new transaction
+    nonce = Transaction.new_nonce()
+    signature = wallet.sign_transaction(sender=wallet.public_key, recipient=recipient, amount=amount, nonce=nonce)
+    success = blockchain.add_transaction(recipient, wallet.public_key, signature, amount, nonce)
     if success:
         response = {
             'message': 'Successfully added transaction.',
@@ -169,7 +258,8 @@ def add_transaction():
                 'sender': wallet.public_key,
                 'recipient': recipient,
                 'amount': amount,
-                'signature': signature
+                'signature': signature,
+                'nonce': nonce
             },
             'fund': blockchain.get_balance()
         }
@@ -181,16 +271,57 @@ def add_transaction():
         return jsonify(response), 500
 
  
+# add many transactions at once, e.g. payouts
+@app.route('/transactions/batch', methods=['POST'])
+def add_transactions():
+    if wallet.public_key is None:
+        response = {
+            'message': 'No wallet set up.'
+        }
+        return jsonify(response), 400
+    values = request.get_json()
+    if not values or not isinstance(values.get('transactions'), list):
+        response = {
+            'message': 'No data found.'
+        }
+        return jsonify(response), 400
+    required_fields = ['recipient', 'amount']
+    if not all(field in tx for tx in values['transactions'] for field in required_fields):
+        response = {
+            'message': 'Required data is missing.'
+        }
+        return jsonify(response), 400
+    # signed all at once, large batches on several cores (see Wallet.sign_transactions)
+    # the same payout twice (in one list or in two requests) is paid twice, every payment has its own nonce
+    payments = [(tx['recipient'], tx['amount'], Transaction.new_nonce()) for tx in values['transactions']]
+    signatures = wallet.sign_transactions(payments)
+    transactions = [{
+        'sender': wallet.public_key,
+        'recipient': recipient,
+        'amount': amount,
+        'signature': signature,
+        'nonce': nonce
+    } for (recipient, amount, nonce), signature in zip(payments, signatures)]
+    results = blockchain.add_transactions(transactions)
+    response = {
+        'message': 'Added {} of {} transactions.'.format(sum(results), len(results)),
+        'results': results,
+        'transactions': [tx for tx, added in zip(transactions, results) if added],
+        'fund': blockchain.get_balance()
+    }
+    # 201 if at least one transaction was added, results tells which ones
+    return jsonify(response), 201 if any(results) else 500
+
+
 @app.route('/mine', methods=['POST'])
 def mine():
-    # we never mine a block if we know we have conflict
+    # we never mine a block if we know we have conflict, resolving runs by itself (see Blockchain.request_resolve)
     if blockchain.resolve_conflicts:
-        response = {'message': 'Resolve conflicts first, block not added!'}
+        response = {'message': 'Resolving conflicts, block not added! Try again shortly.'}
         return jsonify(response), 409
     block = blockchain.mine_block()  # mine block return block
     if block is not None:
-        dict_block = block.__dict__.copy()
-        dict_block['transactions'] = [tx.__dict__ for tx in dict_block['transactions']]
+        dict_block = block.to_dict()
         response = {
             'message': 'Block added successfully.',
             'block': dict_block,
@@ -220,20 +351,181 @@ def resolve_conflicts():
 def get_open_transaction():
     # transactions is a list of transaction, not including reward tx
     transactions = blockchain.get_open_transactions()
-    dict_transactions = [tx.__dict__ for tx in transactions]
+    dict_transactions = [tx.to_dict() for tx in transactions]
     return jsonify(dict_transactions), 200
 
 
 @app.route('/chain', methods=['GET'])
 def get_chain():
+    """
+    blocks of the chain, all of them by default
+    ?from=<index>&to=<index> (to not included), ?limit=<n>, ?since=<block hash> (blocks after that block)
+    blocks are converted one by one while the response is sent, so the whole chain is never in memory
+    with ?format=ndjson or Accept: application/x-ndjson there is one block per line instead of a json list
+    with Accept: application/x-blockchain the blocks come in the binary form of utility.codec (what resolve asks for)
+    """
+    chain_snapshot = blockchain.chain
+    start = max(request.args.get('from', 0, type=int), 0)
+    end = min(request.args.get('to', len(chain_snapshot), type=int), len(chain_snapshot))
+    since = request.args.get('since')
+    if since is not None:
+        since_index = blockchain.get_block_index(since)
+        if since_index is None:
+            response = {'message': 'Block not found.'}
+            return jsonify(response), 404
+        start = max(start, since_index + 1)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        end = min(end, start + max(limit, 0))
+    indexes = range(start, end)
+
+    if wants_binary():
+        blocks = (chain_snapshot[index] for index in indexes)
+        return Response(encode_block_list(blocks, len(indexes)), mimetype=MIMETYPE), 200
+
+    if request.args.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        lines = (json.dumps(chain_snapshot[index].to_dict()) + '\n' for index in indexes)
+        return Response(lines, mimetype='application/x-ndjson'), 200
+
+    def json_list():
+        yield '['
+        for position, index in enumerate(indexes):
+            # convert block into dict, and transactions into dict as well
+            yield (',' if position > 0 else '') + json.dumps(chain_snapshot[index].to_dict())
+        yield ']'
+    return Response(json_list(), mimetype='application/json'), 200
+
+
+@app.route('/headers', methods=['GET'])
+def get_headers():
+    """
+    block headers without transactions, ?from=<index>&to=<index> (to not included), ?limit=<n>
+    a syncing node validates these first and only then asks for the block bodies
+    with Accept: application/x-blockchain they come as binary blocks without transactions
+    """
+    chain_snapshot = blockchain.chain
+    height = len(chain_snapshot)
+    start = max(request.args.get('from', 0, type=int), 0)
+    end = min(request.args.get('to', height, type=int), height)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        end = min(end, start + max(limit, 0))
+    if wants_binary():
+        indexes = range(start, max(start, end))
+        blocks = (chain_snapshot[index] for index in indexes)
+        return Response(encode_block_list(blocks, len(indexes), with_transactions=False), mimetype=MIMETYPE), 200
+    return jsonify(blockchain.get_headers(start, end)), 200
+
+
+@app.route('/block/<int:index>', methods=['GET'])
+def get_block(index):
+    block = blockchain.get_block(index)
+    if block is None:
+        response = {'message': 'Block not found.'}
+        return jsonify(response), 404
+    return jsonify(block.to_dict()), 200
+
+
+@app.route('/block/hash/<block_hash>', methods=['GET'])
+def get_block_by_hash(block_hash):
+    index = blockchain.get_block_index(block_hash)
+    if index is None:
+        response = {'message': 'Block not found.'}
+        return jsonify(response), 404
+    return jsonify(blockchain.get_block(index).to_dict()), 200
+
+
+@app.route('/proof/<tx_id>', methods=['GET'])
+def get_transaction_proof(tx_id):
+    """ merkle inclusion proof, a light client checks it against a block header with utility.merkle """
+    proof = blockchain.get_transaction_proof(tx_id)
+    if proof is None:
+        response = {'message': 'Transaction not found in the chain.'}
+        return jsonify(response), 404
+    return jsonify(proof), 200
+
+
+@app.route('/address/<address>/transactions', methods=['GET'])
+def get_address_transactions(address):
+    """
+    transactions an address (public key) sent or received, oldest first
+    ?from=<n> skips its first n transactions, ?limit=<n> (at most ADDRESS_PAGE_LIMIT) per page
+    """
+    start = max(request.args.get('from', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', ADDRESS_PAGE_LIMIT, type=int), 0), ADDRESS_PAGE_LIMIT)
+    result = blockchain.get_address_history(address, start, limit)
+    if result is None:
+        response = {'message': 'A light node has no transactions.'}
+        return jsonify(response), 400
+    total, history = result
+    response = {
+        'address': address,
+        'total': total,
+        'from': start,
+        'limit': limit,
+        'transactions': history
+    }
+    return jsonify(response), 200
+
+
+@app.route('/snapshot', methods=['GET'])
+def get_snapshot():
+    """ last signed snapshot of the balances, a new node can start from it with --snapshot-from """
+    snapshot = blockchain.get_snapshot()
+    if snapshot is None:
+        response = {'message': 'No snapshot yet.'}
+        return jsonify(response), 404
+    return jsonify(snapshot), 200
+
+
+@app.route('/chain/tip', methods=['GET'])
+def get_chain_tip():
     chain_snapshot = blockchain.chain
-    # convert block into dict, however transaction still is object
-    dict_chain = [block.__dict__.copy() for block in chain_snapshot]  # list of block dict
-    for dict_block in dict_chain:
-        # convert list of tx object to list of tx dict
-        dict_block['transactions'] = [tx.__dict__ for tx in dict_block['transactions']]
+    response = {
+        'height': len(chain_snapshot),
+        'hash': chain_snapshot.block_hash(-1)
+    }
+    return jsonify(response), 200
 
-    return jsonify(dict_chain), 200
+
+@app.route('/chain/hashes', methods=['GET'])
+def get_chain_hashes():
+    start = request.args.get('from', 0, type=int)
+    end = request.args.get('to', len(blockchain.chain), type=int)
+    return jsonify(blockchain.get_block_hashes(start, end)), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """ counters, gauges and histograms in the Prometheus text format """
+    metrics.set('chain_height', len(blockchain.chain))
+    metrics.set('mempool_size', blockchain.get_mempool_size())
+    metrics.set('orphan_blocks', blockchain.get_orphan_count())
+    metrics.set('side_blocks', blockchain.get_side_block_count())
+    metrics.set('peer_nodes', len(blockchain.get_peer_nodes()))
+    metrics.set('healthy_peer_nodes', len(blockchain.get_healthy_peer_nodes()))
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4'), 200
+
+
+@app.route('/profiler', methods=['POST'])
+def toggle_profiler():
+    """ {"enabled": true, "interval": 0.01} starts the sampling profiler, {"enabled": false} stops it """
+    values = request.get_json()
+    if not values or 'enabled' not in values:
+        response = {'message': 'No data found.'}
+        return jsonify(response), 400
+    if values['enabled']:
+        profiler.start(values.get('interval', profiler.interval))
+    else:
+        profiler.stop()
+    response = {'message': 'Profiler is {}.'.format('running' if profiler.running else 'stopped')}
+    return jsonify(response), 200
+
+
+@app.route('/profiler', methods=['GET'])
+def get_profile():
+    """ samples so far as collapsed stacks (flamegraph.pl / speedscope), ?limit=<n> for the most frequent ones """
+    return Response(profiler.report(request.args.get('limit', type=int)), mimetype='text/plain'), 200
 
 
 @app.route('/node', methods=['POST'])
@@ -277,7 +569,9 @@ def remove_node(node_url):
 def get_node():
     nodes = blockchain.get_peer_nodes()
     response = {
-        'all_nodes': nodes
+        'all_nodes': nodes,
+        # round trip time (seconds), failures in a row, last answer, chain height and backoff of every peer
+        'peers': blockchain.get_peer_stats()
     }
     return jsonify(response), 200
 
@@ -287,11 +581,37 @@ if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser()
     parser.add_argument('-p', '--port', type=int, default=5003)
+    # headers only, no balances and no mining
+    parser.add_argument('--light', action='store_true')
+    # start a fresh node from the snapshot of this peer (host:port), signed by one of the --trust public keys
+    parser.add_argument('--snapshot-from')
+    parser.add_argument('--trust', action='append', default=[])
+    # drop the transactions of blocks covered by a snapshot
+    parser.add_argument('--prune', action='store_true')
+    # dev: flask development server, waitress: production server (in environment.yml)
+    parser.add_argument('--server', choices=['dev', 'waitress'], default='dev')
+    # flask debugger and reloader for the dev server, never for a node others can reach
+    parser.add_argument('--debug', action='store_true')
+    parser.add_argument('--threads', type=int, default=8)
+    # signature scheme of new wallet keys, a loaded wallet keeps its own, every node verifies all of them
+    parser.add_argument('--key-scheme', choices=SCHEMES, default='rsa')
     args = parser.parse_args()
     port = args.port
 
-    wallet = Wallet(port)
-    blockchain = Blockchain(wallet.public_key, port)
+    wallet = Wallet(port, scheme=args.key_scheme)
+    blockchain_options = {
+        'light': args.light,
+        'signer': wallet.sign_message,
+        'trusted_keys': args.trust,
+        'bootstrap_node': args.snapshot_from,
+        'prune': args.prune
+    }
+    blockchain = Blockchain(wallet.public_key, port, **blockchain_options)
 
-    # run() take 2 args, IP and port
-    app.run(host='0.0.0.0', port=port, debug=True)
+    # requests are served on several threads, Blockchain takes care of the locking
+    if args.server == 'waitress':
+        from waitress import serve
+        serve(app, host='0.0.0.0', port=port, threads=args.threads)
+    else:
+        # run() take 2 args, IP and port
+        app.run(host='0.0.0.0', port=port, debug=args.debug, threaded=True)
@@ -1,6 +1,7 @@
 from src.models.blockchain import Blockchain
 from src.utility import Verification
 from src.models.wallet import Wallet
+from src.models.transaction import Transaction
 
 
 class Node:
@@ -50,9 +51,10 @@ class Node:
             if user_choice == '1':
                 tx_data = self.get_transaction_value()  # from user input
                 recipient, amount = tx_data
-                signature = self.wallet.sign_transaction(sender=self.wallet.public_key, recipient=recipient, amount=amount)
+                nonce = Transaction.new_nonce()
+                signature = self.wallet.sign_transaction(sender=self.wallet.public_key, recipient=recipient, amount=amount, nonce=nonce)
                 # signature should be pass if you want to add transaction
-                if self.blockchain.add_transaction(recipient=recipient, sender=self.wallet.public_key, signature=signature, amount=amount):
+                if self.blockchain.add_transaction(recipient=recipient, sender=self.wallet.public_key, signature=signature, amount=amount, nonce=nonce):
                     print('Added transaction!')
                 else:
                     print('Transaction failed!')
@@ -0,0 +1,437 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from utility.codec import block_from_payload, block_payload, transaction_from_payload, transaction_payload
+from utility.metrics import metrics
+
+"""
+On-disk layout of a node, everything lives in the folder blockchain-<node_id>/
+
+chain-000000.log, chain-000001.log ...   append-only segments, BLOCKS_PER_SEGMENT blocks each
+chain.idx                                one fixed-size entry per block (offset, length, hash)
+mempool.log                              append-only open transactions and removals of them (b'-' + raw id),
+                                         compacted when a block is added or removals pile up (Blockchain)
+peers.json                               peer nodes with round trip time, failures and height, see PeerManager
+ledger.json                              balance index checkpoint, see Blockchain.load_data
+snapshot.json                            last signed snapshot (balances at a block), see Blockchain.bootstrap
+pruned.json                              height below which blocks are stored without transactions, see prune
+
+every record in a .log file is framed as [payload length][crc32 of payload][payload]
+so a half written record at the end of a file (crash while writing) can be detected and cut off
+payloads are in the binary form of utility.codec, records written as json by older versions are still read
+"""
+
+BLOCKS_PER_SEGMENT = 1000
+MEMPOOL_REMOVAL = b'-'  # payload prefix of a mempool.log record dropping an earlier transaction
+MAX_MAPPED_SEGMENTS = 16  # every mapping keeps a file descriptor open
+RECORD_HEADER = struct.Struct('>II')  # payload length, crc32
+INDEX_ENTRY = struct.Struct('>QI32s')  # offset in segment, record length (header included), block hash
+
+
+def encode_record(payload):
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(f):
+    """
+    yield (offset, record length, payload) for every complete record of an open file
+    stop at the first torn or corrupted record
+    """
+    offset = f.tell()
+    while True:
+        header = f.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        yield offset, RECORD_HEADER.size + length, payload
+        offset += RECORD_HEADER.size + length
+
+
+class BlockStore:
+    """
+    append-only storage for one node
+    writing a block, a transaction or the peers costs the same no matter how long the chain is
+    """
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.path = 'blockchain-{}'.format(node_id)
+        self.height = 0  # number of blocks on disk
+        self.pruned_height = 0  # blocks below this height only have their header
+        self.mempool_records = 0  # records in mempool.log, transactions and removals
+        self.__maps = OrderedDict()  # file name -> read only mmap, most recently used last
+        # readers run on many server threads, a mapping must not be closed while one of them copies from it
+        self.__maps_lock = threading.RLock()
+        try:
+            self.finish_prune()
+            os.makedirs(self.path, exist_ok=True)
+            self.recover()
+            self.pruned_height = self.load_pruned_height()
+        except IOError:
+            print('Opening block store failed!')
+
+    def __written(self, operation, size, start):
+        metrics.inc('store_write_bytes_total', size, operation=operation)
+        metrics.observe('store_write_seconds', time.perf_counter() - start, operation=operation)
+
+    def __file(self, name):
+        return os.path.join(self.path, name)
+
+    def __segment_name(self, height):
+        return 'chain-{:06d}.log'.format(height // BLOCKS_PER_SEGMENT)
+
+    def __read_index_entry(self, f, height):
+        f.seek(height * INDEX_ENTRY.size)
+        return INDEX_ENTRY.unpack(f.read(INDEX_ENTRY.size))
+
+    def recover(self):
+        """
+        bring chain.idx and the last segment back in line after a crash
+        a torn entry or record at the end is truncated, nothing else is lost
+        """
+        index_name = self.__file('chain.idx')
+        if not os.path.exists(index_name):
+            open(index_name, 'wb').close()
+        index_size = os.path.getsize(index_name)
+        height = index_size // INDEX_ENTRY.size
+        # index entries are written after their record, so only the last entries can point past the data
+        with open(index_name, 'rb') as idx:
+            while height > 0:
+                offset, length, _ = self.__read_index_entry(idx, height - 1)
+                segment_name = self.__file(self.__segment_name(height - 1))
+                if os.path.exists(segment_name) and os.path.getsize(segment_name) >= offset + length:
+                    break
+                height -= 1
+        if index_size != height * INDEX_ENTRY.size:
+            with open(index_name, 'r+b') as idx:
+                idx.truncate(height * INDEX_ENTRY.size)
+        self.height = height
+
+        # cut everything in the last segment after the last indexed record
+        segment_name = self.__file(self.__segment_name(height))
+        if height % BLOCKS_PER_SEGMENT == 0:
+            end = 0
+        else:
+            with open(index_name, 'rb') as idx:
+                offset, length, _ = self.__read_index_entry(idx, height - 1)
+            end = offset + length
+        if os.path.exists(segment_name) and os.path.getsize(segment_name) > end:
+            with open(segment_name, 'r+b') as f:
+                f.truncate(end)
+        self.__remove_segments_after(height)
+
+        mempool_name = self.__file('mempool.log')
+        if os.path.exists(mempool_name):
+            with open(mempool_name, 'r+b') as f:
+                end = 0
+                for offset, length, _ in read_records(f):
+                    end = offset + length
+                    self.mempool_records += 1
+                f.truncate(end)
+
+    def __remove_segments_after(self, height):
+        """ delete segment files which only hold blocks at or above height """
+        first_unused = (height + BLOCKS_PER_SEGMENT - 1) // BLOCKS_PER_SEGMENT
+        for name in os.listdir(self.path):
+            if name.startswith('chain-') and name.endswith('.log') and int(name[6:12]) >= first_unused:
+                os.remove(self.__file(name))
+
+    def append_block(self, block, block_hash):
+        """ block is a Block object, block_hash its hex hash (hash_block) """
+        try:
+            start = time.perf_counter()
+            record = encode_record(block_payload(block))
+            with open(self.__file(self.__segment_name(self.height)), 'ab') as f:
+                offset = f.tell()
+                f.write(record)
+            with open(self.__file('chain.idx'), 'ab') as idx:
+                idx.write(INDEX_ENTRY.pack(offset, len(record), bytes.fromhex(block_hash)))
+            self.height += 1
+            self.__written('append_block', len(record) + INDEX_ENTRY.size, start)
+            return True
+        except IOError:
+            print('Saving failed!')
+            return False
+
+    def truncate(self, height):
+        """ drop every block from height on, used when the chain is replaced """
+        if height >= self.height:
+            return
+        # a mapped file must not shrink under its mapping, readers wait until it is done
+        with self.__maps_lock:
+            self.close_maps()
+            try:
+                with open(self.__file('chain.idx'), 'r+b') as idx:
+                    if height % BLOCKS_PER_SEGMENT == 0:
+                        end = 0
+                    else:
+                        offset, length, _ = self.__read_index_entry(idx, height - 1)
+                        end = offset + length
+                    idx.truncate(height * INDEX_ENTRY.size)
+                segment_name = self.__file(self.__segment_name(height))
+                if os.path.exists(segment_name):
+                    with open(segment_name, 'r+b') as f:
+                        f.truncate(end)
+                self.height = height
+                self.__remove_segments_after(height)
+            except IOError:
+                print('Saving failed!')
+
+    def block_hashes(self):
+        """ list of hex hashes of the stored blocks, read from the index only """
+        with open(self.__file('chain.idx'), 'rb') as idx:
+            data = idx.read(self.height * INDEX_ENTRY.size)
+        return [entry[2].hex() for entry in INDEX_ENTRY.iter_unpack(data)]
+
+    def __mapped(self, name, end):
+        """
+        read only mmap of a file which covers at least end bytes
+        files only grow at the end, so a mapping is only renewed when it is too short
+        """
+        # only called with __maps_lock held, see __read
+        mapped = self.__maps.pop(name, None)
+        if mapped is None or len(mapped) < end:
+            if mapped is not None:
+                mapped.close()
+            with open(self.__file(name), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__maps[name] = mapped
+        if len(self.__maps) > MAX_MAPPED_SEGMENTS + 1:  # + 1 for chain.idx
+            self.__maps.popitem(last=False)[1].close()
+        return mapped
+
+    def __read(self, name, start, end):
+        """ bytes start to end - 1 of a file, copied out of its mapping """
+        with self.__maps_lock:
+            return self.__mapped(name, end)[start:end]
+
+    def close_maps(self):
+        with self.__maps_lock:
+            for mapped in self.__maps.values():
+                mapped.close()
+            self.__maps.clear()
+
+    def __index_entry(self, height):
+        # checked with the lock held, a truncate can not shorten the index between the check and the read
+        with self.__maps_lock:
+            if not 0 <= height < self.height:
+                raise IndexError('block index out of range')
+            return INDEX_ENTRY.unpack(self.__read('chain.idx', height * INDEX_ENTRY.size,
+                                                  (height + 1) * INDEX_ENTRY.size))
+
+    def block_hash(self, height):
+        """ hex hash of the block at height, without reading the block """
+        return self.__index_entry(height)[2].hex()
+
+    def read_payload(self, height):
+        """ the stored bytes of the block at height, only this record is read from the mapped segment """
+        # entry and record are read with the lock held, so both belong to the same block
+        with self.__maps_lock:
+            offset, length, _ = self.__index_entry(height)
+            payload = self.__read(self.__segment_name(height), offset + RECORD_HEADER.size, offset + length)
+        metrics.inc('store_read_bytes_total', length, operation='read_block')
+        return payload
+
+    def read_block(self, height):
+        """ the block at height as Block object """
+        return block_from_payload(self.read_payload(height))
+
+    def prune(self, height):
+        """
+        drop the transactions of the blocks below height, their headers (and so their hashes) stay
+        only the segments with blocks between the last prune height and height are rewritten, one at a time:
+        the new segment and its index entries are written next to the old one first, see __prune_segment
+        """
+        height = min(height, self.height)
+        if height <= self.pruned_height:
+            return
+        try:
+            first_segment = self.pruned_height // BLOCKS_PER_SEGMENT * BLOCKS_PER_SEGMENT
+            for first in range(first_segment, height, BLOCKS_PER_SEGMENT):
+                self.__prune_segment(first, min(first + BLOCKS_PER_SEGMENT, self.height), height)
+            tmp_name = self.__file('pruned.json.tmp')
+            with open(tmp_name, 'w') as f:
+                f.write(json.dumps({'height': height}))
+            os.replace(tmp_name, self.__file('pruned.json'))
+            self.pruned_height = height
+        except IOError:
+            print('Pruning failed!')
+
+    def __prune_segment(self, first, end, height):
+        """
+        rewrite the segment of the blocks first to end - 1, the ones below height without transactions
+        <segment>.prune is the new segment, <segment>.idx.prune its index entries, a crash at any point
+        leaves either the old segment and entries or the new ones, see finish_prune
+        """
+        name = self.__segment_name(first)
+        entries = bytearray()
+        with open(self.__file(name + '.prune'), 'wb') as segment:
+            for index in range(first, end):
+                payload = self.read_payload(index)
+                if index < height:
+                    payload = block_payload(block_from_payload(payload), with_transactions=False)
+                record = encode_record(payload)
+                entries += INDEX_ENTRY.pack(segment.tell(), len(record), bytes.fromhex(self.block_hash(index)))
+                segment.write(record)
+        with open(self.__file(name + '.idx.tmp'), 'wb') as f:
+            f.write(INDEX_ENTRY.pack(first, 0, b'') + entries)  # the first entry only says where the entries go
+        os.replace(self.__file(name + '.idx.tmp'), self.__file(name + '.idx.prune'))
+        # no reader may use the old mapping with the new offsets
+        with self.__maps_lock:
+            self.close_maps()
+            os.replace(self.__file(name + '.prune'), self.__file(name))
+            self.__apply_index_entries(name)
+
+    def __apply_index_entries(self, name):
+        """ write the index entries of a rewritten segment into chain.idx, then forget them """
+        with open(self.__file(name + '.idx.prune'), 'rb') as f:
+            data = f.read()
+        first = INDEX_ENTRY.unpack_from(data)[0]
+        with open(self.__file('chain.idx'), 'r+b') as idx:
+            idx.seek(first * INDEX_ENTRY.size)
+            idx.write(data[INDEX_ENTRY.size:])
+        os.remove(self.__file(name + '.idx.prune'))
+
+    def finish_prune(self):
+        """
+        after a crash in prune: a segment which was swapped in gets its index entries,
+        a new segment which was not swapped in yet is thrown away (the old one is still complete)
+        """
+        # a store of an older version which was pruned by copying it as a whole
+        if not os.path.exists(self.path) and os.path.exists(self.path + '.prune'):
+            os.replace(self.path + '.prune', self.path)
+        shutil.rmtree(self.path + '.prune', ignore_errors=True)
+        shutil.rmtree(self.path + '.old', ignore_errors=True)
+        if not os.path.exists(self.path):
+            return
+        for name in os.listdir(self.path):
+            if name.startswith('chain-') and name.endswith('.idx.prune'):
+                segment_name = name[:-len('.idx.prune')]
+                if os.path.exists(self.__file(segment_name + '.prune')):
+                    os.remove(self.__file(name))  # not swapped in, the old segment and entries still match
+                else:
+                    self.__apply_index_entries(segment_name)
+        for name in os.listdir(self.path):
+            if name.startswith('chain-') and (name.endswith('.log.prune') or name.endswith('.idx.tmp')):
+                os.remove(self.__file(name))
+
+    def load_pruned_height(self):
+        try:
+            with open(self.__file('pruned.json'), 'r') as f:
+                return min(json.loads(f.read())['height'], self.height)
+        except (IOError, ValueError, KeyError):
+            return 0
+
+    def append_transactions(self, transactions, removed=()):
+        """
+        several transactions with one write, removed are the ids of earlier written transactions which are not open
+        any more (e.g. dropped to make room), they are written first
+        """
+        try:
+            start = time.perf_counter()
+            records = [encode_record(MEMPOOL_REMOVAL + bytes.fromhex(tx_id)) for tx_id in removed]
+            records += [encode_record(transaction_payload(tx)) for tx in transactions]
+            with open(self.__file('mempool.log'), 'ab') as f:
+                f.write(b''.join(records))
+            self.mempool_records += len(records)
+            self.__written('append_transactions', sum(len(record) for record in records), start)
+        except IOError:
+            print('Saving failed!')
+
+    def save_transactions(self, transactions):
+        """ rewrite the mempool file, it only holds open transactions so it stays small """
+        try:
+            start = time.perf_counter()
+            tmp_name = self.__file('mempool.log.tmp')
+            with open(tmp_name, 'wb') as f:
+                count = 0
+                for tx in transactions:
+                    f.write(encode_record(transaction_payload(tx)))
+                    count += 1
+                size = f.tell()
+            os.replace(tmp_name, self.__file('mempool.log'))
+            self.mempool_records = count
+            self.__written('save_transactions', size, start)
+        except IOError:
+            print('Saving failed!')
+
+    def load_transactions(self):
+        """ list of Transaction objects, the removals replayed """
+        try:
+            transactions = OrderedDict()  # {tx id: transaction}
+            with open(self.__file('mempool.log'), 'rb') as f:
+                for _, _, payload in read_records(f):
+                    if payload[:1] == MEMPOOL_REMOVAL:
+                        transactions.pop(payload[1:].hex(), None)
+                    else:
+                        tx = transaction_from_payload(payload)
+                        transactions[tx.id()] = tx
+                metrics.inc('store_read_bytes_total', f.tell(), operation='load_transactions')
+            return list(transactions.values())
+        except IOError:
+            return []
+
+    def save_peers(self, peers):
+        """ peers is the state of a PeerManager (dict), a plain list of nodes is kept as it is """
+        try:
+            tmp_name = self.__file('peers.json.tmp')
+            with open(tmp_name, 'w') as f:
+                f.write(json.dumps(peers if isinstance(peers, dict) else list(peers)))
+            os.replace(tmp_name, self.__file('peers.json'))
+        except IOError:
+            print('Saving failed!')
+
+    def save_ledger(self, height, block_hash, balances):
+        """ checkpoint of the balance index after the first height blocks, block_hash is the hash of the last one """
+        try:
+            tmp_name = self.__file('ledger.json.tmp')
+            with open(tmp_name, 'w') as f:
+                f.write(json.dumps({'height': height, 'hash': block_hash, 'balances': balances}))
+            os.replace(tmp_name, self.__file('ledger.json'))
+        except IOError:
+            print('Saving failed!')
+
+    def load_ledger(self):
+        """ the last checkpoint as dict, None if there is none or it does not belong to the stored chain """
+        return self.__load_checkpoint('ledger.json')
+
+    def save_snapshot(self, snapshot):
+        """ snapshot is a dict with height, hash and balances like a ledger checkpoint, plus signer and signature """
+        try:
+            tmp_name = self.__file('snapshot.json.tmp')
+            with open(tmp_name, 'w') as f:
+                f.write(json.dumps(snapshot))
+            os.replace(tmp_name, self.__file('snapshot.json'))
+        except IOError:
+            print('Saving failed!')
+
+    def load_snapshot(self):
+        """ the last snapshot as dict, None if there is none or it does not belong to the stored chain """
+        return self.__load_checkpoint('snapshot.json')
+
+    def __load_checkpoint(self, name):
+        try:
+            with open(self.__file(name), 'r') as f:
+                checkpoint = json.loads(f.read())
+        except (IOError, ValueError):
+            return None
+        height = checkpoint['height']
+        if not 0 < height <= self.height or self.block_hash(height - 1) != checkpoint['hash']:
+            return None
+        return checkpoint
+
+    def load_peers(self):
+        try:
+            with open(self.__file('peers.json'), 'r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return []
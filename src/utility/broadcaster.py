@@ -0,0 +1,155 @@
+import heapq
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from models.peer_manager import CONNECT_TIMEOUT
+from utility.codec import CODEC_HEADER, FORMAT_VERSION, MIMETYPE
+from utility.metrics import metrics
+
+
+BROADCAST_QUEUE_SIZE = 1000  # messages waiting to be sent, new ones are dropped when full
+BROADCAST_WORKERS = 8  # peers posted to at the same time
+BROADCAST_PENDING_MAX = 1000  # posts handed to the workers or waiting for a retry, the queue waits while this is full
+BROADCAST_TIMEOUT = (CONNECT_TIMEOUT, 3)  # seconds to connect, seconds to wait for an answer
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5  # seconds before the first retry, doubled for every further retry
+
+
+class Broadcaster:
+    """
+    sends messages to every peer node in the background
+    the request which created a transaction or block returns once it is stored locally,
+    a slow or dead peer only keeps one worker busy instead of the whole node,
+    a retry waits in a timer heap instead of sleeping in a worker
+    peers is the PeerManager of the node: the fastest peers get a message first, a peer which is backing off
+    gets none, and every answer or failure is recorded there
+    """
+    def __init__(self, peers):
+        self.__peers = peers
+        self.__queue = queue.Queue(maxsize=BROADCAST_QUEUE_SIZE)
+        self.__pool = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS)
+        # the pool queues without limit, every post holds one of these until it is done (retries included)
+        self.__pending = threading.BoundedSemaphore(BROADCAST_PENDING_MAX)
+        self.__retries = []  # heap of (due time, number, post), see __schedule_retries
+        self.__retries_changed = threading.Condition()
+        self.__retry_number = 0  # keeps posts with the same due time apart in the heap
+        self.__sessions = {}  # {node: requests.Session}, keeps connections to a peer open
+        self.__sessions_lock = threading.Lock()
+        # peers which sent CODEC_HEADER with our FORMAT_VERSION, they get binary bodies
+        self.__binary_nodes = set()
+        threading.Thread(target=self.__dispatch, daemon=True).start()
+        threading.Thread(target=self.__schedule_retries, daemon=True).start()
+
+    def broadcast(self, path, payload, on_response=None, encoded=None):
+        """
+        post payload (json) to http://<peer>/<path> on every peer
+        encoded is the same message in the binary form of utility.codec, sent instead to peers which support it
+        on_response(node, response) is called from a worker thread for every answer
+        returns False if the queue is full and the message was dropped
+        """
+        try:
+            self.__queue.put_nowait((path, payload, on_response, encoded))
+            metrics.set('broadcast_queue_size', self.__queue.qsize())
+            return True
+        except queue.Full:
+            metrics.inc('broadcast_dropped_total', path=path)
+            print('Broadcast queue is full, {} dropped'.format(path))
+            return False
+
+    def send(self, node, path, payload, on_response=None, encoded=None):
+        """
+        post to one peer only, e.g. the items it asked for after an announcement, see broadcast for the arguments
+        returns False if too many posts are pending and the message was dropped
+        """
+        if not self.__pending.acquire(blocking=False):
+            metrics.inc('broadcast_dropped_total', path=path)
+            print('Too many broadcasts pending, {} to {} dropped'.format(path, node))
+            return False
+        self.__pool.submit(self.__post, (node, path, payload, on_response, encoded, 0))
+        return True
+
+    def forget(self, node):
+        """ close the connections to a removed peer """
+        with self.__sessions_lock:
+            session = self.__sessions.pop(node, None)
+            self.__binary_nodes.discard(node)
+        if session is not None:
+            session.close()
+
+    def __dispatch(self):
+        while True:
+            path, payload, on_response, encoded = self.__queue.get()
+            for node in self.__peers.healthy():
+                # waits while too many posts are pending, the queue fills up and new messages are dropped
+                self.__pending.acquire()
+                self.__pool.submit(self.__post, (node, path, payload, on_response, encoded, 0))
+
+    def __schedule_retries(self):
+        """ hands a post back to the workers when its retry is due """
+        while True:
+            with self.__retries_changed:
+                while not self.__retries or self.__retries[0][0] > time.monotonic():
+                    self.__retries_changed.wait(self.__retries[0][0] - time.monotonic() if self.__retries else None)
+                _, _, post = heapq.heappop(self.__retries)
+            self.__pool.submit(self.__post, post)
+
+    def __retry_later(self, post, delay):
+        with self.__retries_changed:
+            self.__retry_number += 1
+            heapq.heappush(self.__retries, (time.monotonic() + delay, self.__retry_number, post))
+            self.__retries_changed.notify()
+
+    def __session(self, node):
+        with self.__sessions_lock:
+            session = self.__sessions.get(node)
+            if session is None:
+                session = requests.Session()
+                session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=BROADCAST_WORKERS))
+                self.__sessions[node] = session
+            return session
+
+    def __post(self, post):
+        """ one attempt, post is (node, path, payload, on_response, encoded, attempt) """
+        node, path, payload, on_response, encoded, attempt = post
+        url = 'http://{}/{}'.format(node, path)
+        start = time.perf_counter()
+        try:
+            if encoded is not None and node in self.__binary_nodes:
+                response = self.__session(node).post(url, data=encoded, headers={'Content-Type': MIMETYPE},
+                                                     timeout=BROADCAST_TIMEOUT)
+            else:
+                response = self.__session(node).post(url, json=payload, timeout=BROADCAST_TIMEOUT)
+        # the server of node is not running or too slow, try again a bit later
+        # unless it failed before as well, then it is backing off (see PeerManager.record_failure)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.__peers.record_failure(node)
+            if attempt == MAX_RETRIES or not self.__peers.available(node):
+                metrics.inc('broadcast_failures_total', peer=node, path=path)
+                print('Broadcast to {} failed'.format(node))
+                self.__pending.release()
+                return
+            metrics.inc('broadcast_retries_total', peer=node, path=path)
+            # the post keeps its place in __pending while it waits
+            self.__retry_later((node, path, payload, on_response, encoded, attempt + 1), RETRY_BACKOFF * 2 ** attempt)
+            return
+        except Exception:
+            self.__pending.release()
+            raise
+        self.__pending.release()
+        elapsed = time.perf_counter() - start
+        metrics.observe('broadcast_seconds', elapsed, peer=node, path=path)
+        self.__peers.record_success(node, elapsed)
+        # every answer tells whether the peer (still) reads the binary form
+        if response.headers.get(CODEC_HEADER) == str(FORMAT_VERSION):
+            self.__binary_nodes.add(node)
+        else:
+            self.__binary_nodes.discard(node)
+        if response.status_code >= 400:
+            metrics.inc('broadcast_declined_total', peer=node, path=path)
+        if on_response is not None:
+            on_response(node, response)
@@ -0,0 +1,325 @@
+import json
+import struct
+
+from models.block import Block
+from models.transaction import Transaction
+
+"""
+compact binary form of blocks and transactions, used for the block store and between nodes which both support it
+
+    block        [FORMAT_VERSION][b'B'] index previous_hash timestamp proof difficulty merkle_root
+                 [varint number of addresses] address ...
+                 [varint number of transactions] ([varint sender][varint recipient] amount signature nonce) ...
+    transaction  [FORMAT_VERSION][b'T'] sender recipient amount signature nonce
+    block list   [FORMAT_VERSION][b'L'][varint number of blocks] ([varint length][block payload]) ...
+
+every field is a tagged value: ints as varints, floats as 8 bytes, hex strings (keys, signatures, hashes)
+as their raw bytes, any other string as utf8. A value comes back exactly as it was, 10 stays an int and
+10.0 a float, so block hashes and transaction ids do not change. A transaction without nonce has a none value.
+payloads of version 1 (before the nonce, stored by older nodes) are still read, they have no nonce field.
+inside a block every address (public key) is written once, transactions refer to it by its position
+a json payload starts with '{', so a stored record or a list element can be in either form
+"""
+
+FORMAT_VERSION = 2
+READ_VERSIONS = (1, 2)  # versions decode_block and decode_transaction take, version 1 has no nonce
+MIMETYPE = 'application/x-blockchain'
+# every response of a node carries this header with FORMAT_VERSION, a peer only sends binary bodies after seeing it
+CODEC_HEADER = 'X-Blockchain-Codec'
+# what a syncing node asks for, a node which does not know the binary form answers with json
+ACCEPT = MIMETYPE + ', application/json;q=0.5'
+
+BLOCK = ord('B')
+TRANSACTION = ord('T')
+BLOCK_LIST = ord('L')
+
+# value tags
+INT = 0
+NEGATIVE_INT = 1
+FLOAT = 2
+HEX = 3
+TEXT = 4
+NONE = 5  # only for a missing nonce, see write_nonce
+
+DOUBLE = struct.Struct('>d')
+unpack_double = DOUBLE.unpack_from
+
+
+def write_varint(out, number):
+    while number > 0x7f:
+        out.append(number & 0x7f | 0x80)
+        number >>= 7
+    out.append(number)
+
+
+def read_varint(data, offset):
+    """ (number, offset after it) """
+    number = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def write_value(out, value):
+    if type(value) is int:
+        if value >= 0:
+            out.append(INT)
+            write_varint(out, value)
+        else:
+            out.append(NEGATIVE_INT)
+            write_varint(out, -value)
+    elif type(value) is float:
+        out.append(FLOAT)
+        out += DOUBLE.pack(value)
+    elif type(value) is bytes:
+        out.append(HEX)
+        write_varint(out, len(value))
+        out += value
+    elif type(value) is str:
+        # only lower case hex without spaces comes back as the same text
+        try:
+            raw = bytes.fromhex(value)
+            if raw.hex() != value:
+                raw = None
+        except ValueError:
+            raw = None
+        if raw is None:
+            raw = value.encode()
+            out.append(TEXT)
+        else:
+            out.append(HEX)
+        write_varint(out, len(raw))
+        out += raw
+    else:
+        raise ValueError('{} can not be encoded'.format(type(value).__name__))
+
+
+def read_value(data, offset, raw=False):
+    """ (value, offset after it), with raw a hex value is returned as bytes instead of a hex string """
+    tag = data[offset]
+    offset += 1
+    if tag == INT:
+        return read_varint(data, offset)
+    if tag == NEGATIVE_INT:
+        number, offset = read_varint(data, offset)
+        return -number, offset
+    if tag == FLOAT:
+        return DOUBLE.unpack_from(data, offset)[0], offset + DOUBLE.size
+    length, offset = read_varint(data, offset)
+    end = offset + length
+    if end > len(data):
+        raise ValueError('payload is truncated')
+    if tag == HEX:
+        return (data[offset:end] if raw else data[offset:end].hex()), end
+    if tag == TEXT:
+        return data[offset:end].decode(), end
+    raise ValueError('unknown value tag {}'.format(tag))
+
+
+def write_nonce(out, nonce):
+    """ the nonce of a transaction, the only field which may be missing (None) """
+    if nonce is None:
+        out.append(NONE)
+    else:
+        write_value(out, nonce)
+
+
+def read_nonce(data, offset):
+    if data[offset] == NONE:
+        return None, offset + 1
+    return read_value(data, offset)
+
+
+def write_transaction(out, tx):
+    write_value(out, tx.sender)
+    write_value(out, tx.recipient)
+    write_value(out, tx.amount)
+    write_value(out, tx.raw_signature)
+    write_nonce(out, tx.nonce)
+
+
+def read_transaction(data, offset, version=FORMAT_VERSION):
+    sender, offset = read_value(data, offset)
+    recipient, offset = read_value(data, offset)
+    amount, offset = read_value(data, offset)
+    signature, offset = read_value(data, offset, raw=True)
+    nonce = None
+    if version > 1:
+        nonce, offset = read_nonce(data, offset)
+    return Transaction(sender, recipient, signature, amount, nonce), offset
+
+
+def write_block_transactions(out, transactions):
+    positions = {}  # {address: position in the address list}
+    for tx in transactions:
+        for address in (tx.sender, tx.recipient):
+            if address not in positions:
+                positions[address] = len(positions)
+    write_varint(out, len(positions))
+    for address in positions:
+        write_value(out, address)
+    write_varint(out, len(transactions))
+    for tx in transactions:
+        write_varint(out, positions[tx.sender])
+        write_varint(out, positions[tx.recipient])
+        write_value(out, tx.amount)
+        write_value(out, tx.raw_signature)
+        write_nonce(out, tx.nonce)
+
+
+def read_block_transactions(data, offset, version=FORMAT_VERSION):
+    """ (list of transactions, offset after them), the hot part of decoding a block """
+    count, offset = read_varint(data, offset)
+    addresses = []
+    for _ in range(count):
+        address, offset = read_value(data, offset)
+        addresses.append(address)
+    count, offset = read_varint(data, offset)
+    transactions = []
+    for _ in range(count):
+        # less than 128 addresses in a block is the common case, one byte each
+        sender = data[offset]
+        if sender < 0x80:
+            offset += 1
+        else:
+            sender, offset = read_varint(data, offset)
+        recipient = data[offset]
+        if recipient < 0x80:
+            offset += 1
+        else:
+            recipient, offset = read_varint(data, offset)
+        # amounts are floats and signatures hex, everything else goes the slow way
+        if data[offset] == FLOAT:
+            amount = unpack_double(data, offset + 1)[0]
+            offset += 1 + DOUBLE.size
+        else:
+            amount, offset = read_value(data, offset)
+        if data[offset] == HEX:
+            length, start = read_varint(data, offset + 1)
+            offset = start + length
+            signature = data[start:offset]
+        else:
+            signature, offset = read_value(data, offset, raw=True)
+        nonce = None
+        if version > 1:
+            nonce, offset = read_nonce(data, offset)
+        transactions.append(Transaction(addresses[sender], addresses[recipient], signature, amount, nonce))
+    if offset > len(data):
+        raise ValueError('payload is truncated')
+    return transactions, offset
+
+
+def check_start(data, kind, versions=(FORMAT_VERSION,)):
+    """ (version, offset of the first field, after version and kind) """
+    if len(data) < 2 or data[0] not in versions:
+        raise ValueError('unsupported format version')
+    if data[1] != kind:
+        raise ValueError('payload is not a {}'.format(chr(kind)))
+    return data[0], 2
+
+
+def encode_block(block, with_transactions=True):
+    """ without transactions only the header goes in, it decodes like Block.from_header """
+    out = bytearray((FORMAT_VERSION, BLOCK))
+    for value in (block.index, block.previous_hash, block.timestamp, block.proof, block.difficulty, block.merkle_root):
+        write_value(out, value)
+    write_block_transactions(out, block.transactions if with_transactions else ())
+    return bytes(out)
+
+
+def decode_block(data):
+    try:
+        version, offset = check_start(data, BLOCK, READ_VERSIONS)
+        fields = []
+        for _ in range(6):
+            value, offset = read_value(data, offset)
+            fields.append(value)
+        transactions, offset = read_block_transactions(data, offset, version)
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise ValueError('payload is truncated')
+    if offset != len(data):
+        raise ValueError('payload has trailing bytes')
+    index, previous_hash, timestamp, proof, difficulty, merkle_root = fields
+    return Block(index, previous_hash, transactions, proof, timestamp, difficulty, merkle_root)
+
+
+def encode_transaction(tx):
+    out = bytearray((FORMAT_VERSION, TRANSACTION))
+    write_transaction(out, tx)
+    return bytes(out)
+
+
+def decode_transaction(data):
+    try:
+        version, offset = check_start(data, TRANSACTION, READ_VERSIONS)
+        tx, offset = read_transaction(data, offset, version)
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise ValueError('payload is truncated')
+    if offset != len(data):
+        raise ValueError('payload has trailing bytes')
+    return tx
+
+
+def block_payload(block, with_transactions=True):
+    """ binary form of a block, json for a block with a field the binary form can not hold """
+    try:
+        return encode_block(block, with_transactions)
+    except ValueError:
+        converted = block.to_dict()
+        if not with_transactions:
+            converted['transactions'] = []
+        return json.dumps(converted).encode()
+
+
+def block_from_payload(payload):
+    """ Block object of a payload in either form """
+    if payload[:1] == b'{':
+        return Block.from_dict(json.loads(payload.decode()))
+    return decode_block(payload)
+
+
+def transaction_payload(tx):
+    try:
+        return encode_transaction(tx)
+    except ValueError:
+        return json.dumps(tx.to_dict()).encode()
+
+
+def transaction_from_payload(payload):
+    if payload[:1] == b'{':
+        return Transaction.from_dict(json.loads(payload.decode()))
+    return decode_transaction(payload)
+
+
+def encode_block_list(blocks, count, with_transactions=True):
+    """ yields a block list piece by piece, blocks may be a generator of count blocks """
+    out = bytearray((FORMAT_VERSION, BLOCK_LIST))
+    write_varint(out, count)
+    yield bytes(out)
+    for block in blocks:
+        payload = block_payload(block, with_transactions)
+        out = bytearray()
+        write_varint(out, len(payload))
+        yield bytes(out) + payload
+
+
+def decode_block_list(data):
+    """ list of Block objects """
+    try:
+        # the list itself is the same in every version, its blocks say which one they are
+        _, offset = check_start(data, BLOCK_LIST, READ_VERSIONS)
+        count, offset = read_varint(data, offset)
+        blocks = []
+        for _ in range(count):
+            length, offset = read_varint(data, offset)
+            if offset + length > len(data):
+                raise ValueError('payload is truncated')
+            blocks.append(block_from_payload(data[offset:offset + length]))
+            offset += length
+    except IndexError:
+        raise ValueError('payload is truncated')
+    return blocks
@@ -0,0 +1,61 @@
+import math
+
+"""
+difficulty is the number of leading zero bits the proof of work hash needs,
+every block carries the difficulty it was mined with
+every RETARGET_INTERVAL blocks the difficulty is adjusted so blocks come about every TARGET_BLOCK_TIME seconds
+"""
+
+INITIAL_DIFFICULTY = 8  # 8 zero bits, same as the old '00' hex prefix
+TARGET_BLOCK_TIME = 10  # seconds between two blocks
+RETARGET_INTERVAL = 10  # blocks between two adjustments
+MAX_ADJUSTMENT = 2  # bits per adjustment, so at most 4 times easier or harder
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 255
+
+
+def valid_difficulty(difficulty):
+    """ difficulty comes from peers as well, only an int from MIN_DIFFICULTY to MAX_DIFFICULTY is one """
+    return type(difficulty) is int and MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY
+
+
+def target(difficulty):
+    """ a proof is valid if its hash, read as integer, is below this number """
+    return 1 << (256 - difficulty)
+
+
+def meets_target(digest, difficulty):
+    """ digest is the raw sha256 digest (bytes) of a guess """
+    return int.from_bytes(digest, 'big') < target(difficulty)
+
+
+def next_difficulty(chain, height=None):
+    """
+    difficulty the block at height must have, height defaults to the next block (len(chain))
+    only chain[height - 1] and chain[height - RETARGET_INTERVAL] are read
+    """
+    if height is None:
+        height = len(chain)
+    last_block = chain[height - 1]
+    # the genesis block has timestamp 0, so a window including it says nothing about block time
+    if height % RETARGET_INTERVAL != 0 or height - RETARGET_INTERVAL < 1:
+        return last_block.difficulty
+    first_block = chain[height - RETARGET_INTERVAL]
+    actual_time = max(last_block.timestamp - first_block.timestamp, 1e-6)
+    expected_time = TARGET_BLOCK_TIME * (RETARGET_INTERVAL - 1)
+    # twice as fast as expected means one more zero bit
+    adjustment = round(math.log2(expected_time / actual_time))
+    adjustment = max(-MAX_ADJUSTMENT, min(MAX_ADJUSTMENT, adjustment))
+    return max(MIN_DIFFICULTY, min(MAX_DIFFICULTY, last_block.difficulty + adjustment))
+
+
+def block_work(difficulty):
+    """ guesses a block of this difficulty takes on average, none for an invalid one (its proof is never valid) """
+    if not valid_difficulty(difficulty):
+        return 0
+    return 1 << difficulty
+
+
+def chain_work(blocks):
+    """ work of a run of blocks, the branch with the most work is the chain, not the one with the most blocks """
+    return sum(block_work(block.difficulty) for block in blocks)
@@ -1,31 +1,65 @@
 import hashlib
 import json
+import math
+from json.encoder import encode_basestring_ascii
 
 
 def hash_string_256(string):
     return hashlib.sha256(string).hexdigest()
 
 
-# proof_of_work will call this func
-def hash_block(block):
-    # return '-'.join([str(block[key]) for key in block])
-    # use json.dumps to convert dict obj to json(string)
+def hash_transaction(transaction):
+    """ hash of what the sender signed (sender, recipient, amount and nonce, see wallet.transaction_message) """
+    message = str(transaction.sender) + str(transaction.recipient) + str(transaction.amount)
+    if transaction.nonce is not None:
+        message += ':' + str(transaction.nonce)
+    return hash_string_256(message.encode('utf8'))
+
+
+def encode_value(value):
+    """ the text json.dumps(value) produces, for the str, int and float fields of blocks and transactions """
+    if type(value) is str:
+        return encode_basestring_ascii(value)
+    if type(value) is int:
+        return int.__repr__(value)
+    if type(value) is float and math.isfinite(value):
+        return float.__repr__(value)
+    return json.dumps(value)
+
+
+def canonical_transaction(transaction):
+    """ json.dumps(transaction.to_ordered_dict(), sort_keys=True), without building the dict """
+    # no nonce field for a transaction without one, so its id stays what it was
+    nonce = '' if transaction.nonce is None else ', "nonce": ' + encode_value(transaction.nonce)
+    return '{"amount": ' + encode_value(transaction.amount) + nonce + \
+           ', "recipient": ' + encode_value(transaction.recipient) + \
+           ', "sender": ' + encode_value(transaction.sender) + '}'
+
+
+def transaction_id(transaction):
+    """ identifies a transaction, hash of its canonical fields plus its signature """
+    return hash_string_256((transaction.canonical() + transaction.signature).encode())
+
+
+def header_prefix(block):
     """
-    copy() is used to get a new dictionary - otherwise,
-    changes will affect the old dictionary and can lead to unwanted side effects
-    (i.e. changes in this place having impact on the data in your running application/blockchain).
-    You should be able to observe this if you omit copy().
-
-    if not use copy(), when ever you hash a block,
-    this hashable_block will overwrite the
-    previous reference to previous dictionary
-    it got for last block it hashed
-    so for next block you are hashing
-    you also change something about last block
+    the block header without the proof: index, previous hash, merkle root, timestamp and difficulty
+    the hash of a block is sha256(header_prefix(block) + str(proof)), which is also what the proof of work is about,
+    so a guess costs the same no matter how many transactions the block has
     """
-    hashable_block = block.__dict__.copy()  # {'index': 2, 'previous_hash': ...., 'transactions':[tx object, ...]}
+    return '{}:{}:{}:{}:{}:'.format(encode_value(block.index), block.previous_hash, block.merkle_root,
+                                    encode_value(block.timestamp), encode_value(block.difficulty)).encode()
+
+
+def canonical_snapshot(snapshot):
+    """ the bytes a snapshot signature is made over, every field except the signature """
+    return json.dumps({key: value for key, value in snapshot.items() if key != 'signature'}, sort_keys=True).encode()
 
-    # now converting tx object to ordered_dict, that is why make a copy without changing hashable_block
-    hashable_block['transactions'] = [tx.to_ordered_dict() for tx in hashable_block['transactions']]
-    return hash_string_256(json.dumps(hashable_block, sort_keys=True).encode())
 
+# proof_of_work will call this func
+def hash_block(block):
+    """
+    a block computes its hash once and remembers it until one of its fields is changed,
+    see Block.hash and header_prefix
+    """
+    return block.hash()
@@ -0,0 +1,57 @@
+import hashlib
+
+"""
+merkle tree over the transaction ids of a block
+a pair of nodes is hashed as sha256(left bytes + right bytes), an odd node at the end of a level is paired with itself
+(a block must not list a transaction twice, see Verification.valid_merkle_root)
+"""
+
+EMPTY_ROOT = hashlib.sha256(b'').hexdigest()  # root of a block without transactions (genesis block)
+
+
+def hash_pair(left, right):
+    return hashlib.sha256(bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def next_level(level):
+    if len(level) % 2 == 1:
+        level = level + [level[-1]]
+    return [hash_pair(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+
+
+def merkle_root(leaves):
+    """ leaves are hex hashes (transaction ids) """
+    if not leaves:
+        return EMPTY_ROOT
+    level = list(leaves)
+    while len(level) > 1:
+        level = next_level(level)
+    return level[0]
+
+
+def merkle_path(leaves, position):
+    """
+    the hashes needed to get from leaves[position] to the root,
+    list of {'hash': sibling hash, 'side': 'left' or 'right' (where the sibling is)}
+    """
+    path = []
+    level = list(leaves)
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level = level + [level[-1]]
+        sibling = position ^ 1
+        path.append({'hash': level[sibling], 'side': 'left' if sibling < position else 'right'})
+        level = next_level(level)
+        position //= 2
+    return path
+
+
+def verify_merkle_path(leaf, path, root):
+    """ True if leaf (transaction id) is part of the tree with this root """
+    current = leaf
+    for step in path:
+        if step['side'] == 'left':
+            current = hash_pair(step['hash'], current)
+        else:
+            current = hash_pair(current, step['hash'])
+    return current == root
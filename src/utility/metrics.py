@@ -0,0 +1,136 @@
+import threading
+import time
+from contextlib import contextmanager
+
+"""
+counters, gauges and histograms of a node, rendered in the Prometheus text format by GET /metrics
+every metric can have labels, e.g. metrics.inc('broadcast_failures_total', peer='localhost:5001')
+"""
+
+# upper bounds (seconds) of the histogram buckets, +Inf is added when rendering
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+
+def format_labels(labels, extra=()):
+    """ labels is a tuple of (name, value) pairs, sorted by name """
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metrics:
+    """ thread safe, every update is a dict access with a lock held """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.__lock = threading.Lock()
+        self.__counters = {}  # {(name, labels): value}
+        self.__gauges = {}  # {(name, labels): value}
+        self.__histograms = {}  # {(name, labels): [count per bucket..., sum, count]}
+        self.__help = {}  # {name: description}
+
+    def describe(self, name, description):
+        """ text of the HELP line of a metric """
+        with self.__lock:
+            self.__help[name] = description
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = [0] * (len(self.buckets) + 2)
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[position] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ with metrics.timer('load_data_seconds'): ... observes how long the block took """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        """ every metric in the Prometheus text exposition format """
+        with self.__lock:
+            counters = dict(self.__counters)
+            gauges = dict(self.__gauges)
+            histograms = {key: list(value) for key, value in self.__histograms.items()}
+        lines = []
+        for kind, values in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({name for name, _ in values}):
+                self.__header(lines, name, kind)
+                for (metric, labels), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append('{}{} {}'.format(name, format_labels(labels), value))
+        for name in sorted({name for name, _ in histograms}):
+            self.__header(lines, name, 'histogram')
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(labels, [('le', bound)]), count))
+                lines.append('{}_bucket{} {}'.format(name, format_labels(labels, [('le', '+Inf')]), histogram[-1]))
+                lines.append('{}_sum{} {}'.format(name, format_labels(labels), histogram[-2]))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), histogram[-1]))
+        return '\n'.join(lines) + '\n'
+
+    def __header(self, lines, name, kind):
+        if name in self.__help:
+            lines.append('# HELP {} {}'.format(name, self.__help[name]))
+        lines.append('# TYPE {} {}'.format(name, kind))
+
+
+# HELP lines of the metrics the node records
+DESCRIPTIONS = {
+    'broadcast_declined_total': 'posts to a peer answered with an error status',
+    'broadcast_dropped_total': 'posts dropped because too many were pending',
+    'broadcast_failures_total': 'posts to a peer which did not get an answer',
+    'broadcast_queue_size': 'posts waiting for a broadcast worker',
+    'broadcast_retries_total': 'posts sent again after a failure',
+    'broadcast_seconds': 'time of a post to a peer',
+    'chain_height': 'blocks on our chain',
+    'healthy_peer_nodes': 'peers which are not backing off',
+    'inventory_announced_total': 'blocks and transactions announced to the peers',
+    'inventory_requested_total': 'announced blocks and transactions we asked for',
+    'load_data_seconds': 'time the node took to load its chain at startup',
+    'mempool_size': 'open transactions',
+    'orphan_blocks': 'blocks kept until their parent arrives',
+    'peer_nodes': 'peers, healthy or not',
+    'pow_attempts_total': 'proof of work guesses',
+    'pow_blocks_total': 'blocks mined',
+    'pow_cancelled_total': 'proofs of work given up because another block came first',
+    'pow_hashrate': 'guesses per second of the last proof of work',
+    'pow_seconds': 'time of a proof of work',
+    'side_blocks': 'blocks kept on branches with less work than our chain',
+    'signature_batch_seconds': 'time to verify the unknown signatures of a batch',
+    'signature_cache_hits_total': 'signatures known to be valid, not verified again',
+    'signature_verify_seconds': 'time to verify one signature',
+    'signatures_verified_total': 'signatures verified',
+    'store_read_bytes_total': 'bytes read from the block store',
+    'store_write_bytes_total': 'bytes written to the block store',
+    'store_write_seconds': 'time of a block store write',
+    'valid_proof_calls_total': 'proofs of work checked',
+}
+
+# one registry for the whole process
+metrics = Metrics()
+for metric_name, metric_description in DESCRIPTIONS.items():
+    metrics.describe(metric_name, metric_description)
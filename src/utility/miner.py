@@ -0,0 +1,82 @@
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+
+from utility.difficulty import target
+
+
+INLINE_ATTEMPTS = 50000  # guesses tried in the calling process before worker processes are started
+BATCH_SIZE = 10000  # guesses a worker makes between two checks of the stop event
+
+
+def search(prefix, proof_target, first_proof, step, stop, results):
+    """
+    worker process, tries first_proof, first_proof + step, first_proof + 2 * step ...
+    prefix is hashed once, every guess only adds the proof to a copy of that hash state
+    same requirement as Verification.valid_proof: the digest as integer is below proof_target
+    """
+    midstate = hashlib.sha256(prefix)
+    proof = first_proof
+    while not stop.is_set():
+        for _ in range(BATCH_SIZE):
+            guess_hash = midstate.copy()
+            guess_hash.update(str(proof).encode())
+            if int.from_bytes(guess_hash.digest(), 'big') < proof_target:
+                results.put(proof)
+                stop.set()  # the other workers can stop as well
+                return
+            proof += step
+
+
+class ProofOfWorkMiner:
+    """
+    finds a proof for a block header prefix on every core
+    the nonce space is split between the workers, the first hit stops all of them
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.__cancelled = threading.Event()
+
+    def cancel(self):
+        """ stop the current search, mine() returns None """
+        self.__cancelled.set()
+
+    def mine(self, prefix, difficulty):
+        self.__cancelled.clear()
+        proof_target = target(difficulty)
+        midstate = hashlib.sha256(prefix)
+        # easy proofs are found before starting processes would pay off
+        for proof in range(INLINE_ATTEMPTS):
+            if proof % BATCH_SIZE == 0 and self.__cancelled.is_set():
+                return None
+            guess_hash = midstate.copy()
+            guess_hash.update(str(proof).encode())
+            if int.from_bytes(guess_hash.digest(), 'big') < proof_target:
+                return proof
+
+        stop = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=search,
+                                             args=(prefix, proof_target, INLINE_ATTEMPTS + i, self.workers, stop, results),
+                                             daemon=True)
+                     for i in range(self.workers)]
+        for process in processes:
+            process.start()
+        try:
+            while True:
+                try:
+                    return results.get(timeout=0.1)
+                except queue.Empty:
+                    if self.__cancelled.is_set():
+                        return None
+                    # every worker died without a result
+                    if not any(process.is_alive() for process in processes) and results.empty():
+                        return None
+        finally:
+            stop.set()
+            for process in processes:
+                process.join(timeout=1)
+                if process.is_alive():
+                    process.terminate()
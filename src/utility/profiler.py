@@ -0,0 +1,69 @@
+import sys
+import threading
+from collections import Counter
+
+"""
+sampling profiler which can be switched on and off while the node runs (POST /profiler)
+every interval the stacks of all threads are recorded, nothing is measured while it is off
+"""
+
+DEFAULT_INTERVAL = 0.01  # seconds between two samples
+MAX_DEPTH = 64  # frames kept per stack
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.__samples = Counter()  # {collapsed stack: number of samples}
+        self.__stop = None  # threading.Event of the running sampler, None while off
+        self.__lock = threading.Lock()
+        self.interval = DEFAULT_INTERVAL
+
+    @property
+    def running(self):
+        return self.__stop is not None
+
+    def start(self, interval=DEFAULT_INTERVAL):
+        """ start sampling, the samples of an earlier run are thrown away """
+        with self.__lock:
+            if self.__stop is not None:
+                return
+            self.__samples = Counter()
+            self.interval = interval
+            self.__stop = threading.Event()
+            threading.Thread(target=self.__sample, args=(self.__stop,), daemon=True).start()
+
+    def stop(self):
+        with self.__lock:
+            if self.__stop is not None:
+                self.__stop.set()
+                self.__stop = None
+
+    def __sample(self, stop):
+        own_id = threading.get_ident()
+        samples = self.__samples
+        while not stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(code.co_filename.rsplit('/', 1)[-1], code.co_name))
+                    frame = frame.f_back
+                stacks.append(';'.join(reversed(stack)))
+            with self.__lock:
+                samples.update(stacks)
+
+    def report(self, limit=None):
+        """
+        collapsed stacks, one 'outer;...;inner count' line per stack, most frequent first
+        (the format flamegraph.pl and speedscope read)
+        """
+        with self.__lock:
+            samples = self.__samples.most_common(limit)
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in samples)
+
+
+# one profiler for the whole process
+profiler = SamplingProfiler()
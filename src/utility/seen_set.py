@@ -0,0 +1,36 @@
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class SeenSet:
+    """
+    the transaction ids and block hashes a node has seen lately, so an item announced by several peers
+    is only requested once, bounded: the least recently seen item is forgotten when a new one does not fit
+    an item can be added for some seconds only, e.g. while it is requested from a peer
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.__items = OrderedDict()  # {item: time it expires, None for never}, least recently seen first
+        self.__lock = threading.Lock()
+
+    def __contains__(self, item):
+        with self.__lock:
+            if item not in self.__items:
+                return False
+            expires = self.__items[item]
+            if expires is not None and expires < time():
+                del self.__items[item]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self.__items)
+
+    def add(self, item, ttl=None):
+        """ ttl: seconds until the item counts as unseen again """
+        with self.__lock:
+            self.__items.pop(item, None)
+            self.__items[item] = None if ttl is None else time() + ttl
+            if len(self.__items) > self.max_size:
+                self.__items.popitem(last=False)
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+from models.transaction import Transaction
+from models.wallet import Wallet
+from utility.hash_util import hash_transaction
+from utility.metrics import metrics
+from utility.worker_pool import WorkerPool
+
+
+VERIFIED_CACHE_SIZE = 100000  # (tx hash, signature) pairs remembered as valid
+
+
+def verify_signature(sender, recipient, signature, amount, nonce=None):
+    """ runs in a worker process, every worker keeps its own cache of parsed public keys """
+    try:
+        return Wallet.verify_transaction(Transaction(sender, recipient, signature, amount, nonce))
+    except (ValueError, TypeError, IndexError):  # sender or signature is not a valid hex key / signature
+        return False
+
+
+class SignatureVerifier:
+    """
+    checks transaction signatures, a signature which was valid once is never checked again
+    (a transaction is verified when it arrives and again when it is mined)
+    large sets are spread over a pool of worker processes
+    """
+    def __init__(self, workers=None):
+        self.__pool = WorkerPool(workers)  # starts its processes the first time a large set arrives
+        self.__verified = OrderedDict()  # {(tx hash, signature): True}, most recently used last
+        # request threads check signatures at the same time, before the Blockchain lock is taken
+        self.__lock = threading.Lock()
+
+    def __key(self, transaction):
+        return hash_transaction(transaction), transaction.signature
+
+    def __remember(self, key):
+        with self.__lock:
+            self.__verified[key] = True
+            if len(self.__verified) > VERIFIED_CACHE_SIZE:
+                self.__verified.popitem(last=False)
+
+    def __is_known(self, key):
+        # another thread may drop the key between the lookup and move_to_end without the lock
+        with self.__lock:
+            if key in self.__verified:
+                self.__verified.move_to_end(key)
+                return True
+            return False
+
+    def verify(self, transaction):
+        key = self.__key(transaction)
+        if self.__is_known(key):
+            metrics.inc('signature_cache_hits_total')
+            return True
+        with metrics.timer('signature_verify_seconds'):
+            valid = verify_signature(transaction.sender, transaction.recipient, transaction.signature,
+                                     transaction.amount, transaction.nonce)
+        metrics.inc('signatures_verified_total')
+        if valid:
+            self.__remember(key)
+        return valid
+
+    def verify_many(self, transactions):
+        """ list with True/False for every transaction, in the same order """
+        keys = [self.__key(tx) for tx in transactions]
+        results = [self.__is_known(key) for key in keys]
+        unknown = [position for position, known in enumerate(results) if not known]
+        metrics.inc('signature_cache_hits_total', len(keys) - len(unknown))
+        if not unknown:
+            return results
+        start = time.perf_counter()
+        pending = [transactions[position] for position in unknown]
+        # large sets are spread over the worker processes, see utility.worker_pool
+        checked = self.__pool.map(verify_signature, [tx.sender for tx in pending], [tx.recipient for tx in pending],
+                                  [tx.signature for tx in pending], [tx.amount for tx in pending],
+                                  [tx.nonce for tx in pending])
+        for position, valid in zip(unknown, checked):
+            results[position] = valid
+            if valid:
+                self.__remember(keys[position])
+        metrics.observe('signature_batch_seconds', time.perf_counter() - start)
+        metrics.inc('signatures_verified_total', len(unknown))
+        return results
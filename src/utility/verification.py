@@ -1,46 +1,120 @@
 
-from utility.hash_util import hash_string_256, hash_block
 from models.wallet import Wallet
+from utility.hash_util import canonical_snapshot, hash_block
+from utility.merkle import merkle_root
+from utility.difficulty import meets_target, next_difficulty, valid_difficulty
+from utility.signature_verifier import SignatureVerifier
+from utility.metrics import metrics
 
 
 # just a helper class, no need to create object
 # having it just for grouping funcs
 class Verification:
+    # shared by every check below, so a signature verified at intake is not verified again when mining
+    signature_verifier = SignatureVerifier()
 
     @staticmethod  # not accessing anything from the class
-    def valid_proof(transactions, last_hash, proof):
+    def valid_proof(block):
         """
         to guess the hash which match requirement
+        the block hash (header with proof) has to start with difficulty zero bits
         """
-        # increment proof until much the requirement
-        guess = (str([tx.to_ordered_dict() for tx in transactions]) + str(last_hash) + str(proof)).encode()
-        guess_hash = hash_string_256(guess)
-        return guess_hash[0:2] == '00'
+        metrics.inc('valid_proof_calls_total')
+        # the difficulty is a field of a block from a peer, 300, 8.0 or '8' would break the target
+        if not valid_difficulty(block.difficulty):
+            return False
+        return meets_target(bytes.fromhex(hash_block(block)), block.difficulty)
+
+    @staticmethod
+    def valid_merkle_root(block):
+        """
+        the header has to commit to exactly the transactions of the block
+        an odd node of the tree is paired with itself, so [a, b, c] and [a, b, c, c] have the same root,
+        a block which lists a transaction twice is rejected, otherwise a peer could add a copy of the reward
+        """
+        ids = [tx.id() for tx in block.transactions]
+        if len(set(ids)) != len(ids):
+            return False
+        return block.merkle_root == merkle_root(ids)
 
     @classmethod  # not need a instance here
-    def verify_chain(cls, blockchain):
-        """ verify entire blockchain"""
-        for (index, block) in enumerate(blockchain):
-            if index == 0:
-                continue
+    def verify_chain(cls, blockchain, start=1, headers_only=False):
+        """
+        verify entire blockchain
+        with start, only the blocks from index start on are checked, the ones before are trusted
+        with headers_only, blocks may come without their transactions (Block.from_header), the merkle root is not checked
+        """
+        for index in range(max(start, 1), len(blockchain)):
+            block = blockchain[index]
+            if block.index != index:
+                return False
             if block.previous_hash != hash_block(blockchain[index - 1]):
                 return False
-            # not including reward transaction so block['transactions'][:-1]
-            if not cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof):
+            if block.timestamp < blockchain[index - 1].timestamp:
+                print("Block is older than the block before")
+                return False
+            if block.difficulty != next_difficulty(blockchain, index):
+                print("Difficulty is invalid")
+                return False
+            if not cls.valid_proof(block):
                 print("Proof of work is invalid")
                 return False
+            if not headers_only and not cls.valid_merkle_root(block):
+                print("Merkle root is invalid")
+                return False
         return True
 
     @staticmethod
-    def verify_transaction(transaction, get_balance, check_funds=True):
+    def verify_links(blocks, last_hash):
+        """
+        blocks (from the genesis block on) are linked by previous_hash and the last one has last_hash
+        used below a trusted snapshot, where the proof of work is not checked again
+        """
+        for index, block in enumerate(blocks):
+            if block.index != index:
+                return False
+            if index > 0 and block.previous_hash != hash_block(blocks[index - 1]):
+                return False
+        return len(blocks) > 0 and hash_block(blocks[-1]) == last_hash
+
+    @staticmethod
+    def verify_snapshot(snapshot, trusted_keys):
+        """ the snapshot is signed by one of trusted_keys """
+        if snapshot.get('signer') not in trusted_keys:
+            return False
+        try:
+            return Wallet.verify_message(snapshot['signer'], canonical_snapshot(snapshot), snapshot['signature'])
+        except (ValueError, TypeError, KeyError):
+            return False
+
+    @classmethod
+    def verify_transaction(cls, transaction, get_balance, check_funds=True):
         if check_funds:
             sender_balance = get_balance(transaction.sender)  # amount_received - amount_sent
-            return sender_balance >= transaction.amount and Wallet.verify_transaction(transaction)
+            return sender_balance >= transaction.amount and cls.signature_verifier.verify(transaction)
         else:
-            return Wallet.verify_transaction(transaction)
+            return cls.signature_verifier.verify(transaction)
+
+    @staticmethod
+    def verify_funds(transactions, get_balance):
+        """
+        True/False for every transaction, whether its sender can pay it
+        every sender's balance is looked up once, accepted transactions are taken off it in order
+        """
+        balances = {}
+        results = []
+        for tx in transactions:
+            if tx.sender not in balances:
+                balances[tx.sender] = get_balance(tx.sender)
+            if balances[tx.sender] >= tx.amount:
+                balances[tx.sender] -= tx.amount
+                results.append(True)
+            else:
+                results.append(False)
+        return results
 
     @classmethod
     def verify_transactions(cls, open_transactions, get_balance):
-        # check_funds is False because we don't need to check funds here, just check signature
-        return all([cls.verify_transaction(tx, get_balance, False) for tx in open_transactions])
+        # no funds check here, just check signature, all of them in one batch
+        return all(cls.signature_verifier.verify_many(open_transactions))
 
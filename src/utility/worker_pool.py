@@ -0,0 +1,30 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+PARALLEL_THRESHOLD = 64  # smaller batches run in this process, workers would cost more than they save
+
+
+class WorkerPool:
+    """
+    worker processes for cpu bound batches (checking and making signatures)
+    the processes are started the first time a batch is large enough, small batches never start them
+    """
+    def __init__(self, workers=None, threshold=PARALLEL_THRESHOLD):
+        self.workers = workers or os.cpu_count() or 1
+        self.threshold = threshold
+        self.__pool = None
+        self.__pool_lock = threading.Lock()  # two threads with large batches must not start two pools
+
+    def map(self, function, *iterables):
+        """ list of function(*args) for every args of iterables (lists of the same length), in the same order """
+        count = len(iterables[0]) if iterables else 0
+        if count < self.threshold or self.workers == 1:
+            return list(map(function, *iterables))
+        with self.__pool_lock:
+            if self.__pool is None:
+                self.__pool = ProcessPoolExecutor(max_workers=self.workers)
+        # a few chunks per worker, so a slow chunk does not keep the others waiting
+        chunksize = max(1, count // (self.workers * 4))
+        return list(self.__pool.map(function, *iterables, chunksize=chunksize))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the node imports its modules from src (python node.py is run there)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,140 @@
+import os
+
+import pytest
+
+from models.block import Block
+from models.transaction import Transaction
+from utility import block_store
+from utility.block_store import INDEX_ENTRY, BlockStore
+from utility.hash_util import hash_block
+
+SIGNATURE = 'ab' * 64
+
+
+@pytest.fixture
+def store_path(tmp_path, monkeypatch):
+    """ a store lives in blockchain-<node_id> of the working directory, two blocks per segment """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(block_store, 'BLOCKS_PER_SEGMENT', 2)
+    return tmp_path / 'blockchain-test'
+
+
+def make_chain(count):
+    blocks = []
+    previous_hash = ''
+    for index in range(count):
+        block = Block(index, previous_hash, [Transaction('MINING', 'alice', '', 10)], index, timestamp=float(index))
+        blocks.append(block)
+        previous_hash = hash_block(block)
+    return blocks
+
+
+def fill(store, blocks):
+    for block in blocks:
+        assert store.append_block(block, hash_block(block))
+
+
+def stored_hashes(store):
+    return [hash_block(store.read_block(height)) for height in range(store.height)]
+
+
+def test_blocks_come_back_after_reopening(store_path):
+    blocks = make_chain(5)
+    store = BlockStore('test')
+    fill(store, blocks)
+    store.close_maps()
+    store = BlockStore('test')
+    assert store.height == 5
+    assert store.block_hashes() == [hash_block(block) for block in blocks]
+    assert stored_hashes(store) == store.block_hashes()
+    assert sorted(name for name in os.listdir(store_path) if name.endswith('.log')) == \
+        ['chain-000000.log', 'chain-000001.log', 'chain-000002.log']
+
+
+def test_torn_index_entry_is_dropped(store_path):
+    blocks = make_chain(3)
+    fill(BlockStore('test'), blocks)
+    with open(store_path / 'chain.idx', 'ab') as idx:
+        idx.write(b'\x00' * (INDEX_ENTRY.size // 2))
+    store = BlockStore('test')
+    assert store.height == 3
+    assert os.path.getsize(store_path / 'chain.idx') == 3 * INDEX_ENTRY.size
+    assert stored_hashes(store) == [hash_block(block) for block in blocks]
+
+
+def test_torn_record_is_dropped(store_path):
+    # the crash came after the index entry, but before the whole record reached the disk
+    blocks = make_chain(3)
+    fill(BlockStore('test'), blocks)
+    segment = store_path / 'chain-000001.log'
+    size = os.path.getsize(segment)
+    with open(segment, 'r+b') as f:
+        f.truncate(size - 5)
+    store = BlockStore('test')
+    assert store.height == 2
+    assert not os.path.exists(segment)
+    assert stored_hashes(store) == [hash_block(block) for block in blocks[:2]]
+    # the next block goes where the torn one was
+    fill(store, blocks[2:])
+    assert BlockStore('test').block_hashes() == [hash_block(block) for block in blocks]
+
+
+def test_record_without_index_entry_is_cut(store_path):
+    # the crash came after the record, before its index entry
+    blocks = make_chain(4)
+    fill(BlockStore('test'), blocks[:3])
+    segment = store_path / 'chain-000001.log'
+    size = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        f.write(b'\x01\x02\x03')
+    store = BlockStore('test')
+    assert store.height == 3
+    assert os.path.getsize(segment) == size
+    fill(store, blocks[3:])
+    assert stored_hashes(store) == [hash_block(block) for block in blocks]
+
+
+def test_torn_mempool_record_is_dropped(store_path):
+    transactions = [Transaction('alice', 'bob', SIGNATURE, amount) for amount in (1.5, 2)]
+    store = BlockStore('test')
+    store.append_transactions(transactions)
+    with open(store_path / 'mempool.log', 'ab') as f:
+        f.write(b'\x00\x00\x00\x40\x00')
+    store = BlockStore('test')
+    assert [tx.to_dict() for tx in store.load_transactions()] == [tx.to_dict() for tx in transactions]
+
+
+def test_mempool_removals_are_replayed(store_path):
+    transactions = [Transaction('alice', 'bob', SIGNATURE, 1.5, nonce=nonce) for nonce in range(4)]
+    store = BlockStore('test')
+    store.append_transactions(transactions[:3])
+    store.append_transactions(transactions[3:], removed=[transactions[0].id(), transactions[2].id()])
+    assert store.mempool_records == 6
+    store = BlockStore('test')
+    assert store.mempool_records == 6
+    assert [tx.id() for tx in store.load_transactions()] == [transactions[1].id(), transactions[3].id()]
+    store.save_transactions(store.load_transactions())
+    assert store.mempool_records == 2
+
+
+@pytest.mark.parametrize('height', [0, 1, 2, 3, 5])
+def test_truncate(store_path, height):
+    blocks = make_chain(5)
+    store = BlockStore('test')
+    fill(store, blocks)
+    # a mapping is open while the files shrink
+    store.read_block(4)
+    store.truncate(height)
+    assert store.height == height
+    assert stored_hashes(store) == [hash_block(block) for block in blocks[:height]]
+    with pytest.raises(IndexError):
+        store.block_hash(height)
+    # the truncated store takes new blocks and reopens the same
+    other = make_chain(6)[height:]
+    for block in other:
+        block.timestamp += 0.5
+    fill(store, other)
+    expected = [hash_block(block) for block in blocks[:height] + other]
+    assert stored_hashes(store) == expected
+    store.close_maps()
+    assert BlockStore('test').block_hashes() == expected
@@ -0,0 +1,107 @@
+import pytest
+
+from models.block import Block
+from models.transaction import Transaction
+from utility.codec import TRANSACTION, decode_block, decode_transaction, encode_block, encode_transaction, write_value
+
+SIGNATURE = 'ab' * 64
+HASH = '00' + 'cd' * 31
+
+
+def make_block(transactions):
+    return Block(3, HASH, transactions, 12345, timestamp=1700000000.5, difficulty=8)
+
+
+def round_trip(tx):
+    return decode_transaction(encode_transaction(tx))
+
+
+def test_int_amount_stays_int():
+    decoded = round_trip(Transaction('alice', 'bob', SIGNATURE, 5))
+    assert decoded.amount == 5 and type(decoded.amount) is int
+
+
+def test_float_amount_stays_float():
+    decoded = round_trip(Transaction('alice', 'bob', SIGNATURE, 5.0))
+    assert decoded.amount == 5.0 and type(decoded.amount) is float
+
+
+def test_negative_int_amount():
+    assert round_trip(Transaction('alice', 'bob', SIGNATURE, -7)).amount == -7
+
+
+@pytest.mark.parametrize('address', ['abcd', 'abc', 'ABCD', 'ab cd', 'MINING', ''])
+def test_hex_and_text_come_back_the_same(address):
+    # only lower case hex is stored as bytes, anything else has to come back as it was given
+    decoded = round_trip(Transaction(address, HASH, SIGNATURE, 1.5))
+    assert decoded.sender == address
+    assert decoded.recipient == HASH
+
+
+def test_empty_signature():
+    # mining rewards are not signed
+    decoded = round_trip(Transaction('MINING', 'bob', '', 10))
+    assert decoded.signature == ''
+    assert decoded.id() == Transaction('MINING', 'bob', '', 10).id()
+
+
+def test_nonce_round_trip():
+    decoded = round_trip(Transaction('alice', 'bob', SIGNATURE, 2.5, nonce=2 ** 47 + 3))
+    assert decoded.nonce == 2 ** 47 + 3
+    assert round_trip(Transaction('alice', 'bob', SIGNATURE, 2.5)).nonce is None
+
+
+def test_nonce_makes_payments_distinct():
+    first = Transaction('alice', 'bob', SIGNATURE, 2.5, nonce=1)
+    second = Transaction('alice', 'bob', SIGNATURE, 2.5, nonce=2)
+    assert first.id() != second.id()
+    # a transaction without nonce keeps the id it had before nonces existed
+    assert Transaction('alice', 'bob', SIGNATURE, 2.5).canonical() == \
+        '{"amount": 2.5, "recipient": "bob", "sender": "alice"}'
+
+
+def test_version_1_payload_is_read():
+    # written by a node from before the nonce, e.g. in its block store
+    out = bytearray((1, TRANSACTION))
+    for value in ('alice', 'bob', 2.5, bytes.fromhex(SIGNATURE)):
+        write_value(out, value)
+    decoded = decode_transaction(bytes(out))
+    assert decoded.to_dict() == Transaction('alice', 'bob', SIGNATURE, 2.5).to_dict()
+
+
+def test_block_round_trip():
+    transactions = [Transaction('alice', 'bob', SIGNATURE, 1.5),
+                    Transaction('bob', 'alice', SIGNATURE, 2, nonce=7),
+                    Transaction('MINING', 'alice', '', 10)]
+    block = make_block(transactions)
+    decoded = decode_block(encode_block(block))
+    assert decoded.hash() == block.hash()
+    assert decoded.merkle_root == block.merkle_root
+    assert [tx.to_dict() for tx in decoded.transactions] == [tx.to_dict() for tx in transactions]
+    assert [type(tx.amount) for tx in decoded.transactions] == [float, int, int]
+
+
+def test_header_only_block():
+    block = make_block([Transaction('alice', 'bob', SIGNATURE, 1.5)])
+    decoded = decode_block(encode_block(block, with_transactions=False))
+    assert decoded.hash() == block.hash()
+    assert decoded.transactions == ()
+
+
+def test_truncated_block_is_rejected():
+    data = encode_block(make_block([Transaction('alice', 'bob', SIGNATURE, 1.5)]))
+    for end in range(len(data)):
+        with pytest.raises(ValueError):
+            decode_block(data[:end])
+
+
+def test_truncated_transaction_is_rejected():
+    data = encode_transaction(Transaction('alice', 'bob', SIGNATURE, 1.5))
+    for end in range(len(data)):
+        with pytest.raises(ValueError):
+            decode_transaction(data[:end])
+
+
+def test_trailing_bytes_are_rejected():
+    with pytest.raises(ValueError):
+        decode_block(encode_block(make_block([])) + b'\x00')
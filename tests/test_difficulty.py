@@ -0,0 +1,20 @@
+import pytest
+
+from models.block import Block
+from utility.difficulty import MAX_DIFFICULTY, MIN_DIFFICULTY, block_work, valid_difficulty
+from utility.verification import Verification
+
+
+@pytest.mark.parametrize('difficulty', [MIN_DIFFICULTY, 8, MAX_DIFFICULTY])
+def test_valid_difficulty(difficulty):
+    assert valid_difficulty(difficulty)
+    assert block_work(difficulty) == 1 << difficulty
+
+
+@pytest.mark.parametrize('difficulty', [0, -1, 256, 300, 8.0, '8', True, None])
+def test_difficulty_of_a_peer_is_rejected(difficulty):
+    # a block from a peer carries any value, checking it must not raise
+    block = Block(1, '00' * 32, [], 0, timestamp=1.0, difficulty=difficulty)
+    assert not valid_difficulty(difficulty)
+    assert not Verification.valid_proof(block)
+    assert block_work(difficulty) == 0